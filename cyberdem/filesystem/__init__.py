@@ -24,10 +24,21 @@ DM20-0711
 """
 
 
+from array import array
 from cyberdem import base
-from itertools import combinations
+from cyberdem.graph import Graph
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import deepcopy
+from datetime import datetime
+from functools import lru_cache
+from heapq import nsmallest
+from itertools import combinations, islice
+from math import ceil
 import inspect
 import json
+import operator
 import os
 import re
 
@@ -36,11 +47,23 @@ class FileSystem():
     """Create a directory structure and file storage and retrieval methods.
 
     Creates file storage, retrieval, and query methods for storing and
-    retrieving CyberObjects, CyberEvents, and Relationships.
+    retrieving CyberObjects, CyberEvents, and Relationships. An index of
+    object IDs to types is kept in a ``.index`` folder inside ``path`` so that
+    objects can be found without searching every folder. Attribute indexes
+    created with :meth:`create_index` are kept in the same folder.
+
+    The json of objects returned by :meth:`get` is kept in a least recently
+    used cache, so repeated lookups of the same ID don't read the file again.
+    Each lookup still returns a new instance, so changing one that isn't
+    saved doesn't change what later lookups return. Saving an object removes
+    it from the cache.
 
     :param path: directory path to store Cyber DEM json files; can be existing
         directory or non-existing
     :type path: string, required
+    :param cache_size: maximum number of objects to keep in the :meth:`get`
+        cache; 0 disables the cache
+    :type cache_size: int, optional (default=1024)
 
     :Example:
         >>> from cyberdem import filesystem
@@ -58,17 +81,685 @@ class FileSystem():
             if test_obj._type:
                 obj_types[test_obj._type] = test_obj
 
-    def __init__(self, path):
+    def __init__(self, path, cache_size=1024):
         """Creates a directory for storing Cyber DEM objects and Events"""
 
+        if not isinstance(cache_size, int) or cache_size < 0:
+            raise ValueError(
+                f'cache_size: {cache_size} must be a non-negative integer')
+
         if not os.path.isdir(path):
             os.mkdir(path)
         self.path = path
         self._folders = []
         for folder in os.listdir(self.path):
-            if os.path.isdir(os.path.join(self.path, folder)):
+            if folder in self.obj_types and \
+                    os.path.isdir(os.path.join(self.path, folder)):
                 self._folders.append(folder)
 
+        # LRU cache of the json of objects returned by get()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        # id -> type index, kept in an append-only journal next to the store
+        self._index_path = os.path.join(self.path, '.index')
+        self._ids = {}
+        # number of journal entries per type; used to tell if an attribute
+        # index saved by flush() is out of date
+        self._generations = {}
+        # IDs of the objects of each type
+        self._members = {}
+        # attribute indexes keyed by (obj_type, attr, kind)
+        self._indexes = {}
+        # connected components of the Relationships, made when first needed
+        self._components = None
+        # networks whose objects are made when they are used, by key
+        self._virtual = {}
+        # number of virtual objects of each type that have been saved over
+        self._saved_over = {}
+        rebuilt = self._load_id_index()
+        self._load_indexes(rebuilt)
+        self._load_virtual()
+
+    def _filepath(self, obj_type, id):
+        """Location of the json file for an object of a given type"""
+
+        return os.path.join(self.path, obj_type, id + '.json')
+
+    def _read(self, obj_type, id):
+        """Loads the json for an object, or None if there is no such file"""
+
+        try:
+            with open(self._filepath(obj_type, id)) as j_file:
+                obj = json.load(j_file)
+        except FileNotFoundError:
+            return None
+        j_file.close()
+        return obj
+
+    def _load_id_index(self):
+        """Loads the id -> type index from the journal, or builds it by
+        walking the FileSystem if no journal exists yet
+
+        :return: True if the index had to be rebuilt
+        """
+
+        journal = os.path.join(self._index_path, 'ids.log')
+        if not os.path.isfile(journal):
+            self.reindex()
+            return True
+        with open(journal) as j_file:
+            for line in j_file:
+                obj_type, _, id = line.rstrip('\n').partition(' ')
+                if obj_type in self.obj_types and id:
+                    self._ids[id] = obj_type
+                    self._generations[obj_type] = \
+                        self._generations.get(obj_type, 0) + 1
+        j_file.close()
+        for id, obj_type in self._ids.items():
+            self._members.setdefault(obj_type, set()).add(id)
+        return False
+
+    def _load_indexes(self, stale=False):
+        """Loads the attribute indexes saved by :meth:`flush`, rebuilding any
+        that are out of date with the journal"""
+
+        rebuild = {}
+        for f in sorted(os.listdir(self._index_path)):
+            if not f.endswith('.json'):
+                continue
+            with open(os.path.join(self._index_path, f)) as j_file:
+                snapshot = json.load(j_file)
+            j_file.close()
+            index = _INDEX_KINDS[snapshot['kind']](
+                snapshot['obj_type'], snapshot['attr'])
+            self._indexes[index.key] = index
+            generation = self._generations.get(index.obj_type, 0)
+            if stale or snapshot['generation'] != generation:
+                rebuild.setdefault(index.obj_type, []).append(index)
+            else:
+                index.load(snapshot['entries'])
+        for obj_type, indexes in rebuild.items():
+            self._build_indexes(obj_type, indexes)
+
+    def _build_indexes(self, obj_type, indexes):
+        """Fills attribute indexes for one type by reading all its objects"""
+
+        for index in indexes:
+            index.clear()
+        try:
+            if obj_type not in self._folders:
+                return
+            path = os.path.join(self.path, obj_type)
+            for f in os.listdir(path):
+                if not f.endswith('.json'):
+                    continue
+                with open(os.path.join(path, f)) as j_file:
+                    obj_dict = json.load(j_file)
+                j_file.close()
+                for index in indexes:
+                    index.add(f[:-5], obj_dict)
+        finally:
+            # even if there are no objects, so later ones are added in order
+            for index in indexes:
+                index.finish()
+
+    def _record(self, entries):
+        """Adds (obj_type, id, obj_dict) entries to the id index, its journal,
+        and the attribute indexes"""
+
+        lines = ''
+        for obj_type, id, obj_dict in entries:
+            previous = self._ids.get(id)
+            if previous is None and self._virtual:
+                self._count_saved_over(id)
+            if previous != obj_type:
+                self._members.setdefault(obj_type, set()).add(id)
+                if previous is not None:
+                    self._members[previous].discard(id)
+            self._ids[id] = obj_type
+            self._generations[obj_type] = \
+                self._generations.get(obj_type, 0) + 1
+            for (index_type, _, _), index in self._indexes.items():
+                if index_type == obj_type:
+                    index.add(id, obj_dict)
+            if self._components is not None:
+                self._components.record(obj_type, id)
+            lines += f'{obj_type} {id}\n'
+        with open(os.path.join(self._index_path, 'ids.log'), 'a') as j_file:
+            j_file.write(lines)
+        j_file.close()
+
+    def _write_index(self, index):
+        """Saves an attribute index next to the journal"""
+
+        snapshot = {
+            'obj_type': index.obj_type,
+            'attr': index.attr,
+            'kind': index.kind,
+            'generation': self._generations.get(index.obj_type, 0),
+            'entries': index.dump()}
+        filepath = os.path.join(self._index_path, index.filename)
+        with open(filepath + '.tmp', 'w') as j_file:
+            json.dump(snapshot, j_file)
+        j_file.close()
+        os.replace(filepath + '.tmp', filepath)
+        index.dirty = False
+
+    def _load_virtual(self):
+        """Loads the parameters of the virtual networks in the FileSystem"""
+
+        folder = os.path.join(self.path, '.virtual')
+        if not os.path.isdir(folder):
+            return
+        from cyberdem.widgets import _VirtualNetwork
+        for filename in sorted(os.listdir(folder)):
+            with open(os.path.join(folder, filename)) as j_file:
+                source = _VirtualNetwork.load(json.load(j_file))
+            j_file.close()
+            self._virtual[source.key] = source
+        for id in self._ids:
+            self._count_saved_over(id)
+
+    def _add_virtual(self, source):
+        """Adds a virtual network (see
+        :func:`cyberdem.widgets.generate_network`) to the FileSystem"""
+
+        if source.key in self._virtual:
+            raise Exception(
+                f'The virtual network is already in {self.path}. Use a '
+                f'different seed.')
+        folder = os.path.join(self.path, '.virtual')
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+        with open(os.path.join(folder, f'{source.key:016x}.json'), 'w') \
+                as j_file:
+            json.dump(source.dump(), j_file)
+        j_file.close()
+        self._virtual[source.key] = source
+
+    def _virtual_object(self, id):
+        """The json of a virtual object, or None"""
+
+        if not self._virtual:
+            return None
+        try:
+            key = int(id.replace('-', ''), 16) >> 64
+        except ValueError:
+            return None
+        source = self._virtual.get(key)
+        return source.get(id) if source is not None else None
+
+    def _count_saved_over(self, id):
+        """Counts an object in :attr:`_saved_over` if it is a virtual one
+        that is stored for the first time"""
+
+        obj = self._virtual_object(id)
+        if obj is not None:
+            self._saved_over[obj['_type']] = \
+                self._saved_over.get(obj['_type'], 0) + 1
+
+    def _virtual_count(self, obj_type):
+        return sum(
+            source.counts.get(obj_type, 0)
+            for source in self._virtual.values())
+
+    def flush(self):
+        """Saves any attribute indexes that changed since they were last saved
+
+        Indexes are kept current in memory by :meth:`save`. Indexes that were
+        not flushed before the FileSystem was closed are rebuilt from the
+        object files the next time it is opened, so flushing only saves time.
+        Using the FileSystem as a context manager flushes on exit.
+
+        :Example:
+            >>> with FileSystem('./test-fs') as fs:
+            ...     fs.save(my_device)
+        """
+
+        for index in self._indexes.values():
+            if index.dirty:
+                self._write_index(index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def create_index(self, obj_type, attr, kind='hash'):
+        """Creates an index on an attribute of one object type
+
+        A ``'hash'`` index maps each value of the attribute to the IDs of the
+        objects with that value; :meth:`query` uses it for ``=`` and ``IN``
+        conditions on the attribute. A ``'range'`` index keeps the numeric,
+        date, and string values of the attribute sorted; :meth:`query` uses
+        it for ``<``, ``>``, ``<=``, ``>=``, ``=`` and ``BETWEEN``
+        conditions, so a range of values is found without a full scan.
+        Either way, only the matching files are read. A ``'column'`` index
+        keeps the value of the attribute for every object; queries that only
+        select and filter on ``id``, ``_type``, and attributes with column
+        indexes are answered without opening any object files. A
+        ``'histogram'`` index counts the objects with each value of the
+        attribute for :meth:`value_counts`. An ``'adjacency'`` index can only
+        be made on ``Relationship`` objects' ``'related_objects'``, and is
+        made by :meth:`neighbors` when it is first needed. Indexes are kept up
+        to date by :meth:`save` and stored in the FileSystem's ``.index``
+        folder.
+
+        :param obj_type: Cyber DEM type to index. Ex. "Device"
+        :type obj_type: string, required
+        :param attr: name of the attribute to index. Ex. "name"
+        :type attr: string, required
+        :param kind: type of index
+        :type kind: string, optional (default='hash') choose from 'hash',
+            'range', 'column', 'histogram', 'adjacency'
+
+        :Example:
+            >>> fs.create_index('Application', 'name')
+            >>> fs.query("SELECT id FROM Application WHERE name='Rapid SCADA'")
+            (['id'], [('9293510b-534b-4dd0-b7c5-78d92e279400',)])
+            >>> fs.create_index('Manipulate', 'event_time', kind='range')
+            >>> fs.query(
+            ...     "SELECT id FROM Manipulate WHERE event_time BETWEEN "
+            ...     "'2020-09-19 10:00' AND '2020-09-19 10:05'")
+            (['id'], [('e4e6a3a1-4a36-4c5c-9b1e-6c9d02a07b1f',)])
+            >>> fs.create_index('Device', 'name', kind='column')
+            >>> fs.query("SELECT id,name FROM Device")  # no files are read
+        """
+
+        if obj_type not in self.obj_types:
+            raise Exception(
+                f'obj_type "{obj_type}" is not an allowed '
+                f'Cyber DEM base type. must be in {self.obj_types}"')
+        if kind not in _INDEX_KINDS:
+            raise ValueError(
+                f'{kind} is not an acceptable value for kind. Choose from '
+                f'{", ".join(_INDEX_KINDS)}')
+        if kind == _AdjacencyIndex.kind and \
+                (obj_type, attr) != ('Relationship', 'related_objects'):
+            raise ValueError(
+                f'{kind} indexes can only be made on '
+                f'Relationship.related_objects')
+        index = _INDEX_KINDS[kind](obj_type, attr)
+        if index.key in self._indexes:
+            return
+        self._build_indexes(obj_type, [index])
+        self._indexes[index.key] = index
+        self._write_index(index)
+
+    def drop_index(self, obj_type, attr, kind='hash'):
+        """Removes an index created by :meth:`create_index`
+
+        :param obj_type: Cyber DEM type of the index
+        :type obj_type: string, required
+        :param attr: name of the indexed attribute
+        :type attr: string, required
+        :param kind: type of index
+        :type kind: string, optional (default='hash')
+        """
+
+        index = self._indexes.pop((obj_type, attr, kind), None)
+        if index is None:
+            raise ValueError(f'There is no {kind} index on {obj_type}.{attr}')
+        if kind == _AdjacencyIndex.kind:
+            self._components = None
+        filepath = os.path.join(self._index_path, index.filename)
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+
+    def neighbors(self, id, relationship_type=None, direction='both'):
+        """IDs of the objects connected to an object by Relationships
+
+        The first call builds an adjacency index of every Relationship (see
+        :meth:`create_index`), which is kept up to date by :meth:`save`;
+        after that, finding the neighbors of an object takes time
+        proportional to how many it has, and no files are read.
+
+        :param id: ID of the object
+        :type id: string, required
+        :param relationship_type: only follow Relationships of this type. Ex.
+            "ResidesOn"
+        :type relationship_type: string, optional (default is every type)
+        :param direction: 'out' for the objects this object is the
+            ``related_object_1`` of a Relationship with, 'in' for the ones it
+            is the ``related_object_2`` of, or 'both'
+        :type direction: string, optional (default='both')
+
+        :return: IDs of the neighboring objects, each listed once
+        :rtype: list of strings
+
+        :Example:
+            >>> fs.neighbors(my_os.id, 'ResidesOn', direction='out')
+            ['0b7d2a4e-63b5-4d0f-a2a6-2be1c5c1f3a4']
+        """
+
+        if direction not in _AdjacencyIndex.directions:
+            raise ValueError(
+                f'{direction} is not an acceptable value for direction. '
+                f'Choose from {", ".join(_AdjacencyIndex.directions)}')
+        return self._adjacency().neighbors(id, relationship_type, direction)
+
+    def _adjacency(self):
+        """The adjacency index of the Relationships, made if needed"""
+
+        key = ('Relationship', 'related_objects', _AdjacencyIndex.kind)
+        if key not in self._indexes:
+            self.create_index(*key)
+        return self._indexes[key]
+
+    def component(self, id):
+        """The connected component of Relationships an object is in
+
+        Components are found with a union-find structure that is made from
+        the adjacency index (see :meth:`neighbors`) the first time it is
+        needed and then kept up to date by :meth:`save`, so finding an
+        object's component takes (nearly) constant time. Saving a
+        Relationship over one that connected different objects makes the
+        components be worked out again the next time they are needed.
+
+        :param id: ID of the object
+        :type id: string, required
+
+        :return: ``id`` of one object in the component that is the same for
+            every object in it, ``size`` (number of objects), and ``types``
+            (number of objects of each Cyber DEM type; None for objects that
+            are in Relationships but not in the FileSystem)
+        :rtype: dict
+
+        :Example:
+            >>> fs.component(my_device.id)
+            {'id': '5d6a...', 'size': 12, 'types': {'Device': 5, \
+                'NetworkLink': 2, 'OperatingSystem': 5}}
+            >>> fs.component(a.id)['id'] == fs.component(b.id)['id']
+            True
+        """
+
+        return self._component_tracker().summary(id, self._ids.get(id))
+
+    def components(self, min_size=2):
+        """Every connected component of Relationships (see
+        :meth:`component`), largest first
+
+        :param min_size: only include components with at least this many
+            objects
+        :type min_size: int, optional (default=2)
+        :rtype: list of dicts
+        """
+
+        return self._component_tracker().summaries(min_size)
+
+    def _component_tracker(self):
+        """The union-find of the Relationships, made if needed"""
+
+        if self._components is None:
+            self._components = _ComponentTracker(self._adjacency(), self._ids)
+        if self._components.stale:
+            self._components.build()
+        return self._components
+
+    def count(self, obj_type):
+        """The number of objects of a type, from the id index, without
+        reading any files
+
+        :param obj_type: Cyber DEM type to count. Ex. "Device"
+        :type obj_type: string, required
+        :rtype: int
+
+        :Example:
+            >>> fs.count('Device')
+            1000
+        """
+
+        if obj_type not in self.obj_types:
+            raise Exception(
+                f'obj_type "{obj_type}" is not an allowed '
+                f'Cyber DEM base type. must be in {self.obj_types}"')
+        count = len(self._members.get(obj_type, ()))
+        virtual = self._virtual_count(obj_type)
+        if virtual:
+            # virtual objects that were saved over are in the id index too
+            count += virtual - self._saved_over.get(obj_type, 0)
+        return count
+
+    def value_counts(self, obj_type, attr):
+        """The number of objects of a type with each value of an attribute
+
+        The first call for an attribute makes a histogram index of it (see
+        :meth:`create_index`), which is kept up to date by :meth:`save`;
+        after that, the counts take time proportional to the number of
+        different values, and no files are read. An object whose value is a
+        list is counted once for each of the different values in it. Objects
+        without the attribute aren't counted.
+
+        :param obj_type: Cyber DEM type of the objects. Ex. "Device"
+        :type obj_type: string, required
+        :param attr: name of the attribute. Ex. "device_types"
+        :type attr: string, required
+
+        :return: (value, number of objects) for each value
+        :rtype: list of tuples
+
+        :Example:
+            >>> fs.value_counts('Device', 'device_types')
+            [('Generic', 900), ('Networking', 50), ('Storage', 20), ...]
+        """
+
+        key = (obj_type, attr, _HistogramIndex.kind)
+        if key not in self._indexes:
+            self.create_index(*key)
+        counts = self._indexes[key].counts()
+        if self._virtual_count(obj_type):
+            # virtual objects aren't indexed, so they are counted as they
+            # are made
+            for source in self._virtual.values():
+                for obj_dict in source.scan(obj_type):
+                    if obj_dict['id'] not in self._ids:
+                        for k in _HistogramIndex.keys(obj_dict.get(attr)):
+                            counts[k] = counts.get(k, 0) + 1
+        return [(_hash_value(k), n) for k, n in counts.items()]
+
+    def _plan(self, obj_type, where, get_attrs):
+        """Chooses how to read the objects of one type for a query
+
+        Reading (and decoding) an object file is assumed to cost
+        ``_FILE_COST`` times as much as taking one ID out of an index, and the
+        cheaper of a full scan and the best index lookup is used. Attributes
+        that have a column index (and ``id`` and ``_type``) are read from the
+        index instead of the object files; if the WHERE clause only uses such
+        attributes, only the files of matching objects are opened, and if
+        the SELECT does too, no files are opened at all.
+        """
+
+        total = len(self._members.get(obj_type, ()))
+        lookup = None
+        if where is not None:
+            lookup = self._plan_where(obj_type, where, total)
+        if lookup is not None and \
+                lookup.rows * _FILE_COST + lookup.cost >= total * _FILE_COST:
+            lookup = None
+
+        columns = {}
+        for attr in _where_attrs(where) if where is not None else ():
+            if attr not in _Plan.builtin_columns:
+                columns[attr] = self._indexes.get(
+                    (obj_type, attr, _ColumnIndex.kind))
+        if None in columns.values():
+            return _Plan(obj_type, lookup, total)
+        read_files = False
+        for attr in get_attrs:
+            if attr not in _Plan.builtin_columns and attr not in columns:
+                columns[attr] = self._indexes.get(
+                    (obj_type, attr, _ColumnIndex.kind))
+                if columns[attr] is None:
+                    del columns[attr]
+                    read_files = True
+        return _Plan(obj_type, lookup, total, columns, read_files)
+
+    def _plan_where(self, obj_type, node, total):
+        """Plans an index lookup for (part of) a WHERE clause
+
+        :return: :class:`_IndexLookup`, or None if the indexes can't narrow
+            down the objects that match
+        """
+
+        kind = node[0]
+        if kind == 'and':
+            lookups = []
+            # range conditions on the same attribute (ex. BETWEEN) are looked
+            # up together, so only the values between both bounds are read
+            ranges = {}
+            for n in node[1]:
+                index = self._range_index(obj_type, n)
+                if index is not None:
+                    ranges.setdefault(index, []).append((n[1], n[3][1]))
+                else:
+                    lookups.append(self._plan_where(obj_type, n, total))
+            for index, conditions in ranges.items():
+                lookups.append(_IndexLookup.range(index, conditions))
+            lookups = sorted([l for l in lookups if l is not None],
+                key=lambda l: l.rows)
+            if not lookups:
+                return None
+            # intersect with more indexes only while taking their IDs out
+            # costs less than the files they are expected to rule out
+            chosen = [lookups[0]]
+            rows = lookups[0].rows
+            for lookup in lookups[1:]:
+                selectivity = lookup.rows / total if total else 0
+                if lookup.cost < rows * (1 - selectivity) * _FILE_COST:
+                    chosen.append(lookup)
+                    rows *= selectivity
+            if len(chosen) == 1:
+                return chosen[0]
+            return _IndexLookup.intersection(chosen, rows)
+        if kind == 'or':
+            lookups = []
+            for n in node[1]:
+                lookup = self._plan_where(obj_type, n, total)
+                if lookup is None:
+                    return None
+                lookups.append(lookup)
+            return _IndexLookup.union(lookups, total)
+
+        index = self._range_index(obj_type, node)
+        if index is not None:
+            return _IndexLookup.range(index, [(node[1], node[3][1])])
+        if kind == 'cmp' and node[1] == '=' and node[3][0] == 'lit':
+            attr, literals = node[2][1], [node[3][1]]
+        elif kind == 'in' and not node[3]:
+            attr, literals = node[1][1], node[2]
+        else:
+            return None
+        index = self._indexes.get((obj_type, attr, _HashIndex.kind))
+        if index is None:
+            return None
+        keys = []
+        for literal in literals:
+            number, moment = _literal_forms(literal)
+            if literal is None or moment is not None:
+                # NULLs aren't indexed, and dates don't compare as strings
+                return None
+            keys.append(_hash_key(literal))
+            if number is not None:
+                keys.append(_hash_key(number))
+        return _IndexLookup.hash(index, keys)
+
+    def _range_index(self, obj_type, node):
+        """The range index that can answer a comparison, if there is one
+
+        Equality uses a hash index on the attribute first, if there is one.
+        """
+
+        if node[0] != 'cmp' or node[3][0] != 'lit' or \
+                node[1] not in _RangeIndex.operators:
+            return None
+        literal = node[3][1]
+        if literal is None or literal is True or literal is False:
+            return None
+        attr = node[2][1]
+        if node[1] == '=' and (obj_type, attr, _HashIndex.kind) in \
+                self._indexes and _literal_forms(literal)[1] is None:
+            return None
+        return self._indexes.get((obj_type, attr, _RangeIndex.kind))
+
+    def cache_info(self):
+        """Statistics for the :meth:`get` object cache
+
+        :return: hits, misses, current size, and maximum size of the cache
+        :rtype: dict
+
+        :Example:
+            >>> fs = FileSystem('./test-fs')
+            >>> fs.get("82ca4ed1-a053-4fc1-b1cc-f4b58b4dbf8c")
+            >>> fs.get("82ca4ed1-a053-4fc1-b1cc-f4b58b4dbf8c")
+            >>> fs.cache_info()
+            {'hits': 1, 'misses': 1, 'size': 1, 'max_size': 1024}
+        """
+
+        return {
+            'hits': self._cache_hits,
+            'misses': self._cache_misses,
+            'size': len(self._cache),
+            'max_size': self._cache_size}
+
+    def clear_cache(self):
+        """Empties the :meth:`get` object cache and resets its statistics"""
+
+        self._cache.clear()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def reindex(self):
+        """Rebuilds the id index and attribute indexes from the FileSystem
+        folders.
+
+        The indexes are normally kept current by :meth:`save`; this is only
+        needed if json files were added, changed, or removed outside of the
+        FileSystem methods. It also compacts the journal the id index is
+        stored in.
+
+        :Example:
+            >>> fs = FileSystem('./test-fs')
+            >>> fs.reindex()
+        """
+
+        if not os.path.isdir(self._index_path):
+            os.mkdir(self._index_path)
+        self._ids = {}
+        self._generations = {}
+        self._members = {}
+        self._components = None
+        self._saved_over = {}
+        # the files may have changed since they were cached
+        self._cache.clear()
+        for obj_type in self._folders:
+            for f in os.listdir(os.path.join(self.path, obj_type)):
+                if f.endswith('.json'):
+                    self._ids[f[:-5]] = obj_type
+                    self._members.setdefault(obj_type, set()).add(f[:-5])
+            self._generations[obj_type] = len(
+                self._members.get(obj_type, ()))
+        for id in self._ids:
+            self._count_saved_over(id)
+
+        # save rebuilt attribute indexes before the journal, so a failure in
+        # between leaves them out of date (and rebuilt) rather than wrong
+        by_type = {}
+        for index in self._indexes.values():
+            by_type.setdefault(index.obj_type, []).append(index)
+        for obj_type, indexes in by_type.items():
+            self._build_indexes(obj_type, indexes)
+            for index in indexes:
+                self._write_index(index)
+
+        with open(os.path.join(self._index_path, 'ids.log'), 'w') as j_file:
+            j_file.write(''.join(
+                f'{obj_type} {id}\n' for id, obj_type in self._ids.items()))
+        j_file.close()
+
     def _create_folder(self, folder_name):
         """Creates a sub-folder in the FileSystem path
 
@@ -78,7 +769,7 @@ class FileSystem():
 
         # sub-folders should match the public classes in the base module
         if folder_name in self.obj_types:
-            os.mkdir(self.path + '/' + folder_name)
+            os.mkdir(os.path.join(self.path, folder_name))
             self._folders.append(folder_name)
         else:
             raise Exception(
@@ -142,21 +833,34 @@ class FileSystem():
 
         if not isinstance(objects, list):
             objects = [objects]
-        for obj in objects:
-            if obj._type not in self._folders:
-                self._create_folder(obj._type)
+        saved = []
+        try:
+            for obj in objects:
+                if obj._type not in self._folders:
+                    self._create_folder(obj._type)
 
-            filepath = os.path.join(self.path, obj._type, obj.id)
+                filepath = self._filepath(obj._type, obj.id)
 
-            if os.path.isfile(filepath+'.json') and not overwrite:
-                raise Exception(
-                    f'Object {obj.id} already exists in '
-                    f'{self.path}. Add "overwrite=True" to overwrite.')
+                exists = self._ids.get(obj.id) == obj._type or \
+                    os.path.isfile(filepath) or (
+                        obj.id not in self._ids and
+                        self._virtual_object(obj.id) is not None)
+                if exists and not overwrite:
+                    raise Exception(
+                        f'Object {obj.id} already exists in '
+                        f'{self.path}. Add "overwrite=True" to overwrite.')
 
-            serialized = obj._serialize()
-            with open(filepath + '.json', 'w') as outfile:
-                json.dump(serialized, outfile, indent=4)
-            outfile.close()
+                self._cache.pop(obj.id, None)
+                serialized = obj._serialize()
+                with open(filepath, 'w') as outfile:
+                    # one write; json.dump writes each token separately
+                    outfile.write(json.dumps(serialized, indent=4))
+                outfile.close()
+                saved.append((obj._type, obj.id, serialized))
+        finally:
+            # index whatever made it to disk, even if a later object failed
+            if saved:
+                self._record(saved)
 
     def get(self, id, obj_type=None):
         """Get an object by ID
@@ -166,7 +870,9 @@ class FileSystem():
         :param obj_type: Cyber DEM type of the id. Ex. "Application"
         :type obj_type: string, optional
 
-        :return: instance of the requested object
+        :return: instance of the requested object; the object's json is
+            cached, so later calls don't read the file again until the object
+            is saved, but each call returns a new instance
         :rtype: cyberdem instance
 
         :Example:
@@ -179,46 +885,115 @@ class FileSystem():
         """
 
         # ensure the obj_type specified is allowed
-        if obj_type:
-            if obj_type not in self.obj_types:
-                raise Exception(
-                    f'obj_type "{obj_type}" is not an allowed '
-                    f'Cyber DEM base type. must be in {self.obj_types}"')
-            filepath = os.path.join(self.path, obj_type)
-        else:
-            filepath = self.path
+        if obj_type and obj_type not in self.obj_types:
+            raise Exception(
+                f'obj_type "{obj_type}" is not an allowed '
+                f'Cyber DEM base type. must be in {self.obj_types}"')
 
         if not isinstance(id, str):
             raise Exception(
                 f'id of type "{type(id)}" is not allowed. Must be a string.')
 
+        cached = self._cache.get(id)
+        if cached is not None and obj_type in (None, cached['_type']):
+            self._cache_hits += 1
+            self._cache.move_to_end(id)
+            return self._instance(cached)
+        self._cache_misses += 1
+
         if obj_type:
-            # if the object type was specified the search is quicker
-            if os.path.isfile(os.path.join(filepath, id) + '.json'):
-                with open(os.path.join(filepath, id) + '.json') as j_file:
-                    obj = json.load(j_file)
-                j_file.close()
+            obj = self._read(obj_type, id)
+            if obj is None and id not in self._ids:
+                obj = self._virtual_object(id)
+                if obj is not None and obj['_type'] != obj_type:
+                    obj = None
         else:
-            # otherwise, you have to search through the whole directory
-            for root, _, files in os.walk(filepath):
-                if id+'.json' in files:
-                    obj_type = os.path.split(root)[1]
-                    with open(os.path.join(root, id) + '.json') as j_file:
-                        obj = json.load(j_file)
-                    j_file.close()
-        del obj['_type']
-        
+            # the id index maps the id straight to its folder
+            obj = None
+            if id in self._ids:
+                obj = self._read(self._ids[id], id)
+            else:
+                obj = self._virtual_object(id)
+            if obj is None:
+                # not in the index (or stale), fall back to the folders
+                for folder in self._folders:
+                    obj = self._read(folder, id)
+                    if obj is not None:
+                        self._record([(folder, id, obj)])
+                        break
+        if obj is None:
+            raise Exception(f'Object {id} not found in {self.path}')
+
+        if self._cache_size:
+            self._cache[id] = obj
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        return self._instance(obj)
+
+    def _instance(self, obj):
+        """A new instance of an object from its json, which is left as it
+        is (changing the instance doesn't change the json)"""
+
+        obj = deepcopy(obj)
+        obj_type = obj.pop('_type')
         return self.obj_types[obj_type](**obj)
 
-    def query(self, query_string):
+    def query(self, query_string, workers=None):
         """Search the FileSystem for a specific object or objects
 
         :param query_string: SQL formatted query string
         :type query_string: string, required
+        :param workers: number of processes to read and filter object files
+            with; large scans are split across the processes, smaller ones
+            are read in this process
+        :type workers: int, optional (default is to use only this process)
 
         :return: attribute names (headers), values of matching objects
         :rtype: 2-tuple of lists
 
+        The WHERE clause supports ``=``, ``<>`` (or ``!=``), ``<``, ``>``,
+        ``<=``, ``>=``, ``[NOT] IN (...)``, ``[NOT] LIKE``, ``BETWEEN ... AND
+        ...``, ``IS [NOT] NULL``, and ``AND``/``OR``/``NOT`` with parentheses.
+        Values are compared by type: numbers as numbers, ``TRUE``/``FALSE`` as
+        booleans, and strings that look like dates (ex. ``'2020-09-18'``) as
+        datetimes when the attribute holds a date. ``LIKE`` patterns use
+        ``%`` for any run of characters and ``_`` for a single character.
+        Objects that do not have an attribute only match ``<>``, ``NOT IN``,
+        ``NOT LIKE``, and ``IS NULL`` conditions on it.
+
+        ``FROM type1 [AS] [alias1] JOIN type2 [AS] [alias2] ON alias2.attr =
+        alias1.attr ...`` joins objects on equal attribute values, such as a
+        Relationship's ``related_object_1`` or ``related_object_2`` and an
+        object's ``id``. A JOIN right after a Relationship that was joined on
+        one of its ends may leave out the ``ON`` to join the object at the
+        other end. Attributes are named ``alias.attr`` (the alias defaults to
+        the type name); names without an alias are from the first type. Each
+        type is read once, and joined with hash tables, so following
+        relationships takes linear time.
+
+        ``COUNT(*)``, ``COUNT(attr)``, ``MIN(attr)``, ``MAX(attr)``,
+        ``SUM(attr)``, and ``AVG(attr)`` in the SELECT aggregate the matching
+        objects, into one row per value of the ``GROUP BY`` attributes if
+        there is a ``GROUP BY`` (and into one row if not). Counts that the
+        indexes already have are answered without reading any objects.
+
+        ``ORDER BY attr1 [ASC|DESC], attr2 ...`` sorts the results, with
+        values of different types ordered as numbers, dates, strings, then
+        booleans, and objects that do not have the attribute last. ``LIMIT n``
+        returns at most n results and ``OFFSET m`` skips the first m; without
+        an ``ORDER BY`` which results come first is arbitrary. Sorting with a
+        ``LIMIT`` only keeps the first ``m + n`` results in memory, and can
+        read the objects in order from a range index instead of reading all
+        of them.
+
+        Indexes made with :meth:`create_index` are used when they are cheaper
+        than reading every object of a type. Starting the query with
+        ``EXPLAIN`` runs it and returns how each type was read instead of the
+        results: the access path chosen, the estimated number of objects to
+        read, and the files opened, bytes read, objects decoded, and rows
+        matched.
+
         :Example query strings:
             * ``SELECT * FROM *`` (you probably shouldn't do this one...)
             * ``SELECT attr1,attr2 FROM * WHERE attr3=value``
@@ -226,6 +1001,20 @@ class FileSystem():
                 device'``
             * ``SELECT id FROM * WHERE (name='foo' AND description='bar') OR\
                  version<>'foobar'``
+            * ``SELECT id FROM NetworkLink WHERE bandwidth>=100 AND \
+                physical_layer IN ('Wired','Wireless')``
+            * ``SELECT id FROM Manipulate WHERE event_time BETWEEN \
+                '2020-09-18' AND '2020-09-19 12:00'``
+            * ``SELECT id,name FROM Device WHERE name LIKE 'Generic%'``
+            * ``SELECT id,name FROM Device LIMIT 50 OFFSET 100``
+            * ``SELECT id,bandwidth FROM NetworkLink ORDER BY bandwidth DESC \
+                LIMIT 10``
+            * ``SELECT os_type,COUNT(*) FROM OperatingSystem GROUP BY os_type``
+            * ``SELECT COUNT(*),AVG(bandwidth) FROM NetworkLink``
+            * ``SELECT Device.name,os.name FROM Device JOIN Relationship r ON \
+                r.related_object_2=Device.id JOIN OperatingSystem os WHERE \
+                r.relationship_type='ResidesOn'``
+            * ``EXPLAIN SELECT id FROM Device WHERE name='HMI'``
 
         :Example:
             >>> query = "SELECT id FROM * WHERE name='Rapid SCADA'"
@@ -238,180 +1027,897 @@ class FileSystem():
             >>> results
             [('9293510b-534b-4dd0-b7c5-78d92e279400',),\
             ('46545b7a-1840-4e34-a26f-aef5eb954b25','My application')]
+            >>> headers, results = fs.query("SELECT * FROM *", workers=8)
         """
 
-        # split the query string into the key components
-        if not query_string.upper().startswith("SELECT "):
-            raise Exception(
-                f'query_string must start with "SELECT ". {query_string}')
-        if " FROM " not in query_string.upper():
-            raise Exception(
-                f'query_string must contain "FROM" statement. {query_string}')
-        q_select = query_string[7:query_string.find(" FROM ")]
-        q_from = query_string[query_string.find(" FROM ")+6:]
-        if " WHERE " in query_string.upper():
-            q_where = query_string[query_string.find(" WHERE ")+7:]
-            q_from = q_from[:q_from.find(" WHERE ")]
-            q_where = q_where.replace('AND', 'and').replace('OR', 'or')
-            q_where = q_where.replace('=', '==').replace('<>', '!=')
-            q_where = q_where.replace(';', '')
-        else:
-            q_where = None
-
-        # find all of the paths to search on (all of the object types)
-        paths = []
-        if q_from == "*":
-            for obj_type in self.obj_types:
-                if os.path.isdir(os.path.join(self.path, obj_type)):
-                    paths.append(os.path.join(self.path, obj_type))
+        headers, rows = self.iquery(query_string, workers)
+        return headers, list(rows)
+
+    def iquery(self, query_string, workers=None):
+        """Search the FileSystem like :meth:`query`, but return the results
+        as they are found
+
+        Objects are only read as the results are iterated over, so memory use
+        does not grow with the number of results, and a query with a
+        ``LIMIT`` stops reading objects once it has enough results.
+
+        :param query_string: SQL formatted query string (see :meth:`query`)
+        :type query_string: string, required
+        :param workers: number of processes to read and filter object files
+            with (see :meth:`query`)
+        :type workers: int, optional
+
+        :return: attribute names (headers), iterator of the values of
+            matching objects
+        :rtype: 2-tuple of list and iterator of tuples
+
+        :Example:
+            >>> headers, results = fs.iquery("SELECT id,name FROM * LIMIT 50")
+            >>> for result in results:
+            ...     print(result)
+        """
+
+        query = _parse_query(query_string)
+
+        # find all of the object types to search
+        if query.from_types == ['*']:
+            from_types = [
+                t for t in self.obj_types
+                if t in self._folders or self._virtual_count(t)]
         else:
-            for obj_type in q_from.split(','):
+            from_types = []
+            for obj_type in query.from_types:
                 if obj_type not in self.obj_types:
                     raise Exception(
                         f'obj_type "{obj_type}" is not an allowed '
                         f'Cyber DEM base type. must be in {self.obj_types}"')
                 # if objects of that type exist in the filesystem
-                if obj_type in os.listdir(self.path):
-                    paths.append(os.path.join(self.path, obj_type))
+                if obj_type in self._folders or \
+                        self._virtual_count(obj_type):
+                    from_types.append(obj_type)
 
         # if the SELECT is *, find all possible class attributes to include
-        if q_select == "*":
+        if query.select == ['*'] and query.tables:
             get_attrs = []
-            for path in paths:
+            for alias, obj_type in query.tables:
+                get_attrs.extend(
+                    f'{alias}.{a}' for a in dir(self.obj_types[obj_type])
+                    if not a.startswith('_'))
+                get_attrs.append(f'{alias}._type')
+        elif query.select == ['*']:
+            get_attrs = []
+            for obj_type in from_types:
                 type_attrs = [
-                    a for a in dir(self.obj_types[os.path.split(path)[1]])
+                    a for a in dir(self.obj_types[obj_type])
                     if not a.startswith('_') and a not in get_attrs]
                 get_attrs.extend(type_attrs)
             get_attrs.append('_type')
         else:
-            get_attrs = q_select.split(',')
-
-        # find all of the attribute names in the WHERE clause
-        if q_where:
-            clauses = re.split('and | or', q_where)
-            where_attrs = []
-            for c in clauses:
-                if '==' in c:
-                    operator = '=='
-                elif '!=' in c:
-                    operator = '!='
-                elif '<' in c:
-                    operator = '<'
-                elif '>' in c:
-                    operator = '>'
-                elif '<=' in c:
-                    operator = '<='
-                elif '>=' in c:
-                    operator = '>='
+            get_attrs = query.select
+
+        if workers is not None and (
+                not isinstance(workers, int) or workers < 1):
+            raise ValueError(f'workers: {workers} must be a positive integer')
+
+        plans = []
+        if query.group_by or query.aggregates:
+            get_attrs = query.headers
+            rows = self._aggregate(query, from_types, workers, plans)
+        elif query.order_by:
+            rows = self._search_ordered(
+                query, from_types, get_attrs, workers, plans)
+        else:
+            rows = self._search(query, from_types, get_attrs, workers, plans)
+        if query.offset or query.limit is not None:
+            stop = None
+            if query.limit is not None:
+                stop = query.offset + query.limit
+            rows = islice(rows, query.offset, stop)
+
+        if query.explain:
+            for _ in rows:
+                pass
+            return list(_Plan.headers), iter(
+                [plan.explain() for plan in plans])
+        return get_attrs, rows
+
+    def _search(
+            self, query, from_types, get_attrs, workers, plans, then=None):
+        """Yields the selected attributes of the objects of each type that
+        match the WHERE clause, adding the plan for each type to ``plans``"""
+
+        if query.tables:
+            yield from self._join(query, get_attrs, workers, plans, then)
+            return
+
+        # the WHERE clause is compiled once and reused for every object
+        if query.where is not None:
+            matches = _compile_where(query.where)
+        else:
+            matches = None
+
+        pool = None
+        try:
+            if workers is not None and workers > 1:
+                pool = ProcessPoolExecutor(max_workers=workers)
+            for obj_type in from_types:
+                plan = self._plan(obj_type, query.where, get_attrs)
+                plan.then = then
+                plans.append(plan)
+                yield from self._execute(
+                    plan, matches, get_attrs, query.where, pool, workers)
+                if self._virtual_count(obj_type):
+                    plan = _Plan(
+                        obj_type, None, self._virtual_count(obj_type),
+                        then=then, virtual=True)
+                    plans.append(plan)
+                    yield from self._virtual_rows(plan, matches, get_attrs)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def _virtual_rows(self, plan, matches, get_attrs):
+        """Makes the virtual objects of a type and yields the selected
+        attributes of the ones that match the WHERE clause, skipping those
+        that have been saved over"""
+
+        for source in self._virtual.values():
+            for obj_dict in source.scan(plan.obj_type):
+                plan.objects_decoded += 1
+                if obj_dict['id'] in self._ids:
+                    continue
+                if matches is None or matches(obj_dict):
+                    plan.rows += 1
+                    yield tuple(obj_dict.get(a) for a in get_attrs)
+
+    def _join(self, query, get_attrs, workers, plans, then=None):
+        """Yields the selected attributes of the joined objects that match
+        the WHERE clause
+
+        Each table is read once, like a query of its own with the parts of
+        the WHERE clause that only use that table (so they can use its
+        indexes). The joined tables are put in hash tables keyed by the
+        attribute they are joined on, and the rows of the first table are
+        streamed through them, so a join takes time linear in the number of
+        objects read and rows returned.
+        """
+
+        # the attributes to read from each table
+        attrs = {alias: [] for alias, _ in query.tables}
+
+        def need(alias, attr):
+            if attr not in attrs[alias]:
+                attrs[alias].append(attr)
+
+        columns = [query.resolve(name) for name in get_attrs]
+        for alias, attr in columns:
+            need(alias, attr)
+        for (alias, _), (attr, other, other_attr) in zip(
+                query.tables[1:], query.joins):
+            need(alias, attr)
+            need(other, other_attr)
+
+        # split the WHERE clause into conditions on one table, checked as it
+        # is read, and conditions on several, checked on the joined rows
+        pushed = {alias: [] for alias, _ in query.tables}
+        joined = []
+        if query.where is not None:
+            nodes = query.where[1] if query.where[0] == 'and' \
+                else [query.where]
+            for node in nodes:
+                used = {query.resolve(n) for n in _where_attrs(node)}
+                aliases = {alias for alias, _ in used}
+                if len(aliases) == 1:
+                    pushed[aliases.pop()].append(
+                        _map_columns(node, lambda n: query.resolve(n)[1]))
                 else:
-                    raise ValueError(f'Unrecognized operator in "{c}"')
-                clause = re.split(operator, c)
-                attr = clause[0].strip().lstrip('(')
-                where_attrs.append((attr, operator))
-
-        # search each file in each path for the desired attributes
-        selected = []
-        for path in paths:
-            for f in os.listdir(path):
-                with open(os.path.join(path, f)) as json_file:
-                    obj_dict = json.load(json_file)
-                json_file.close()
-
-                # check for filtering criteria
-                where_check = q_where
-                if q_where is not None:
-                    for attr in where_attrs:
-                        # change out the attribute name in the WHERE clause
-                        #   for their values from the current object
-                        try:
-                            obj_val = obj_dict[attr[0]]
-                            where_check = where_check.replace(
-                                ''.join(attr), "'"+obj_val+"'"+attr[1])
-                        except KeyError:
-                            where_check = where_check.replace(
-                                ''.join(attr), "'"+attr[0]+"'"+attr[1])
-
-                    matches = eval(where_check)
-                    if not matches:
-                        continue
-
-                match = ()
-                for attr in get_attrs:
-                    try:
-                        match += (obj_dict[attr],)
-                    except KeyError:
-                        match += (None,)
-                selected.append(match)
-
-        return get_attrs, selected
-
-    def save_networkgraph_data(self, nodes='Device', links='NetworkLinks', output_path=None):
+                    joined.append(node)
+                    for alias, attr in used:
+                        need(alias, attr)
+
+        def scan(alias, obj_type, then):
+            table = _Query()
+            table.select = attrs[alias]
+            if len(pushed[alias]) == 1:
+                table.where = pushed[alias][0]
+            elif pushed[alias]:
+                table.where = ('and', pushed[alias])
+            return self._search(
+                table, [obj_type], attrs[alias], workers, plans, then)
+
+        # where each attribute is in a joined row
+        positions = {}
+        for alias, _ in query.tables:
+            for attr in attrs[alias]:
+                positions[(alias, attr)] = len(positions)
+
+        hash_tables = []
+        for (alias, obj_type), (attr, other, other_attr) in zip(
+                query.tables[1:], query.joins):
+            pos = attrs[alias].index(attr)
+            hash_table = {}
+            for row in scan(alias, obj_type, f'hash join build on {attr}'):
+                if row[pos] is not None:
+                    hash_table.setdefault(_hash_key(row[pos]), []).append(row)
+            hash_tables.append((hash_table, positions[(other, other_attr)]))
+
+        alias, obj_type = query.tables[0]
+        rows = scan(alias, obj_type, then)
+        for hash_table, pos in hash_tables:
+            rows = _probe(rows, hash_table, pos)
+        if joined:
+            matches = _compile_where(
+                ('and', joined) if len(joined) > 1 else joined[0],
+                lambda name: operator.itemgetter(
+                    positions[query.resolve(name)]))
+            rows = (row for row in rows if matches(row))
+        selected = [positions[c] for c in columns]
+        for row in rows:
+            yield tuple(row[i] for i in selected)
+
+    def _search_ordered(self, query, from_types, get_attrs, workers, plans):
+        """Yields the selected attributes of the matching objects in ORDER BY
+        order
+
+        With a ``LIMIT``, only the first ``OFFSET + LIMIT`` rows are kept
+        while reading, in a heap. If one type is searched and it has a range
+        index on the ORDER BY attribute, the objects may instead be read in
+        the order of the index, stopping once there are enough rows.
+        """
+
+        # ORDER BY attributes that aren't selected are read, then dropped
+        fetch_attrs = list(get_attrs)
+        for attr, _ in query.order_by:
+            if attr not in fetch_attrs:
+                fetch_attrs.append(attr)
+        key = _order_key(
+            [(fetch_attrs.index(a), d) for a, d in query.order_by])
+
+        rows = None
+        if query.limit is not None and len(from_types) == 1 and \
+                len(query.order_by) == 1 and not query.tables:
+            rows = self._walk_range_index(
+                query, from_types[0], fetch_attrs, key, plans)
+        if rows is None:
+            if query.limit is None:
+                rows = sorted(
+                    self._search(
+                        query, from_types, fetch_attrs, workers, plans,
+                        'sort'),
+                    key=key)
+            else:
+                count = query.offset + query.limit
+                rows = nsmallest(
+                    count,
+                    self._search(
+                        query, from_types, fetch_attrs, workers, plans,
+                        f'top-{count} sort'),
+                    key=key)
+
+        size = len(get_attrs)
+        for row in rows:
+            yield row[:size]
+
+    def _aggregate(self, query, from_types, workers, plans):
+        """Yields one row per GROUP BY group, with the values of the
+        aggregates
+
+        Objects are read as they would be for any other query and folded into
+        the aggregates of their group as they are read, so only one row per
+        group is held in memory. Types whose counts the indexes already have
+        aren't read at all (see :meth:`_index_counts`).
+        """
+
+        aggregates = query.aggregates
+        fetch_attrs = list(query.group_by)
+        for _, attr in aggregates:
+            if attr != '*' and attr not in fetch_attrs:
+                fetch_attrs.append(attr)
+        size = len(query.group_by)
+        positions = [
+            None if attr == '*' else fetch_attrs.index(attr)
+            for _, attr in aggregates]
+
+        groups = {}  # hash keys of the group values -> (values, aggregates)
+
+        def group(values):
+            key = tuple(_hash_key(v) for v in values)
+            entry = groups.get(key)
+            if entry is None:
+                entry = groups[key] = (
+                    values, [_Aggregate(f) for f, _ in aggregates])
+            return entry[1]
+
+        scan_types = []
+        for obj_type in from_types:
+            counts = self._index_counts(query, obj_type, plans)
+            if counts is None:
+                scan_types.append(obj_type)
+                continue
+            for values, n in counts:
+                for i, (_, attr) in enumerate(aggregates):
+                    # COUNT of the GROUP BY attribute skips the NULL group
+                    if attr == '*' or values[0] is not None:
+                        group(values)[i].count += n
+                    else:
+                        group(values)
+        for row in self._search(
+                query, scan_types, fetch_attrs, workers, plans,
+                'hash aggregate'):
+            accumulators = group(row[:size])
+            for pos, accumulator in zip(positions, accumulators):
+                accumulator.add(True if pos is None else row[pos])
+
+        if not groups and not query.group_by:
+            # aggregates over no objects still give one row (ex. COUNT 0)
+            group(())
+        rows = (
+            tuple(values) + tuple(a.result() for a in accumulators)
+            for values, accumulators in groups.values())
+
+        # the result columns are in SELECT order
+        headers = list(query.group_by) + [
+            f'{f}({a})' for f, a in aggregates]
+        order = [headers.index(h) for h in query.headers]
+        rows = (tuple(row[i] for i in order) for row in rows)
+        if query.order_by:
+            headers = query.headers
+            for attr, _ in query.order_by:
+                if attr not in headers:
+                    raise ValueError(
+                        f'ORDER BY {attr} must be one of the selected '
+                        f'columns {headers}')
+            key = _order_key(
+                [(headers.index(a), d) for a, d in query.order_by])
+            if query.limit is None:
+                rows = sorted(rows, key=key)
+            else:
+                rows = nsmallest(query.offset + query.limit, rows, key=key)
+        yield from rows
+
+    def _index_counts(self, query, obj_type, plans):
+        """Counts the objects in each GROUP BY group of a type from the
+        indexes, without reading any objects
+
+        This works for queries with no WHERE clause whose aggregates are all
+        ``COUNT(*)`` or the ``COUNT`` of the one GROUP BY attribute, if it has
+        a hash index (or with no GROUP BY at all).
+
+        :return: list of (group values, number of objects), or None if the
+            indexes can't answer
+        """
+
+        if query.tables or query.where is not None or \
+                self._virtual_count(obj_type) or \
+                len(query.group_by) > 1 or any(
+                    f != 'COUNT' or a not in ['*'] + query.group_by
+                    for f, a in query.aggregates):
+            return None
+        total = len(self._members.get(obj_type, ()))
+        if not query.group_by:
+            plans.append(_Plan(
+                obj_type, _IndexLookup('count of ids', 0, 0, None), total))
+            plans[-1].rows = total
+            return [((), total)]
+        attr = query.group_by[0]
+        index = self._indexes.get((obj_type, attr, _HashIndex.kind))
+        if index is None:
+            return None
+        counts = [
+            ((_hash_value(key),), len(ids))
+            for key, ids in index._ids.items()]
+        unindexed = total - len(index._keys)
+        if unindexed:
+            counts.append(((None,), unindexed))
+        plans.append(_Plan(
+            obj_type,
+            _IndexLookup(f'counts from hash({attr})', 0, len(counts), None),
+            total))
+        plans[-1].rows = total
+        return counts
+
+    def _walk_range_index(self, query, obj_type, fetch_attrs, key, plans):
+        """Reads the objects of one type in the order of the range index on
+        the ORDER BY attribute, if that is expected to be cheaper than
+        reading every object that can match
+
+        :return: iterator of rows, or None if there is no range index or
+            reading in order costs more
+        """
+
+        attr, descending = query.order_by[0]
+        index = self._indexes.get((obj_type, attr, _RangeIndex.kind))
+        if index is None or self._virtual_count(obj_type):
+            return None
+        plan = self._plan(obj_type, query.where, fetch_attrs)
+        members = self._members.get(obj_type, ())
+        total = len(members)
+        unindexed = total - len(index._keys)
+
+        # objects are read in order until enough of them match, assuming
+        # the matching ones are spread evenly through the index
+        count = query.offset + query.limit
+        walked = min(
+            len(index._keys),
+            ceil(count * total / plan.estimated_rows)
+            if plan.estimated_rows else len(index._keys))
+        # the objects without a value in the index sort after the indexed
+        # ones, except that (descending) the ones that have the attribute
+        # come first, so they are only read if they may be needed
+        if descending or walked == len(index._keys):
+            walked += unindexed
+        id_cost = 1 if plan.columns is not None else _FILE_COST
+        cost = plan.estimated_rows * id_cost
+        if plan.lookup is not None:
+            cost += plan.lookup.cost
+        if walked * id_cost > cost:
+            return None
+
+        walk = _IndexLookup(
+            f'ordered range({attr})', walked, walked,
+            lambda: index.ordered(descending))
+        rest = _IndexLookup(
+            'unindexed', unindexed, total,
+            lambda: [id for id in members if id not in index._keys])
+        plan.estimated_rows = walk.rows
+        plans.append(plan)
+        if query.where is not None:
+            matches = _compile_where(query.where)
+        else:
+            matches = None
+        pos = fetch_attrs.index(attr)
+
+        def walk_rows():
+            if descending:
+                plan.lookup = rest
+                others = sorted(
+                    self._execute(plan, matches, fetch_attrs), key=key)
+                plan.lookup = walk
+                yield from (r for r in others if r[pos] is not None)
+                yield from self._execute(plan, matches, fetch_attrs)
+                yield from (r for r in others if r[pos] is None)
+            else:
+                plan.lookup = walk
+                yield from self._execute(plan, matches, fetch_attrs)
+                plan.lookup = rest
+                yield from sorted(
+                    self._execute(plan, matches, fetch_attrs), key=key)
+                plan.lookup = walk
+        return walk_rows()
+
+    def _execute(
+            self, plan, matches, get_attrs, where=None, pool=None, workers=1):
+        """Reads the objects chosen by a plan and yields the selected
+        attributes of the ones that match the WHERE clause
+
+        If a process pool (of ``workers`` processes) is given, large sets of
+        object files are split into chunks that are read and filtered by the
+        pool.
+        """
+
+        obj_type = plan.obj_type
+        folder = os.path.join(self.path, obj_type)
+        if plan.lookup is None:
+            ids = list(self._members.get(obj_type, ()))
+        else:
+            ids = plan.lookup.fetch()
+        columns = plan.columns
+
+        if columns is not None:
+            # filter (and maybe select) with the column indexes
+            if not plan.read_files:
+                for id in ids:
+                    obj_dict = _column_dict(obj_type, id, columns)
+                    if matches is None or matches(obj_dict):
+                        plan.rows += 1
+                        yield tuple(
+                            _copy(obj_dict.get(a)) for a in get_attrs)
+                return
+            if matches is not None:
+                # a list, since matches is cleared below
+                ids = [
+                    id for id in ids
+                    if matches(_column_dict(obj_type, id, columns))]
+            where, matches = None, None
+
+        if pool is not None and len(ids) >= _PARALLEL_MIN:
+            size = max(_PARALLEL_MIN // 4, ceil(len(ids) / (workers * 4)))
+            ids = list(ids)
+            futures = [
+                pool.submit(
+                    _scan_files, folder, ids[i:i+size], where, get_attrs)
+                for i in range(0, len(ids), size)]
+            try:
+                for future in as_completed(futures):
+                    rows, stats = future.result()
+                    plan.add(stats)
+                    plan.rows += len(rows)
+                    yield from rows
+            finally:
+                # the caller may stop early (ex. LIMIT)
+                for future in futures:
+                    future.cancel()
+            return
+
+        for obj_dict in _read_objects(folder, ids, plan):
+            if matches is not None and not matches(obj_dict):
+                continue
+            plan.rows += 1
+            yield tuple(obj_dict.get(a) for a in get_attrs)
+
+    def save_networkgraph_data(
+            self, nodes='Device', links='NetworkLink', output_path=None,
+            shared_links='clique'):
+        """Saves the network graph of the FileSystem as d3.js json
+
+        The ``nodes`` of the graph are the objects of one type, and objects
+        are linked if they are in Relationships with the same object of the
+        ``links`` type (ex. Devices connected to the same NetworkLink). The
+        Relationships are grouped by link with the adjacency index (see
+        :meth:`neighbors`) and the json is written as it is made, so the time
+        taken grows linearly with the size of the graph and memory use does
+        not grow with it.
+
+        :param nodes: Cyber DEM type of the nodes
+        :type nodes: string, optional (default='Device')
+        :param links: Cyber DEM type of the objects that link nodes
+        :type links: string, optional (default='NetworkLink')
+        :param output_path: file to save the graph in
+        :type output_path: string, optional (default is d3js_data.json in the
+            FileSystem folder)
+        :param shared_links: 'clique' links every pair of objects related to
+            the same link, which is n*(n-1)/2 links for n objects; 'hub' adds
+            each link as a node (with ``"hub": true``) linked to its n
+            objects instead
+        :type shared_links: string, optional (default='clique')
+
+        :Example:
+            >>> fs.save_networkgraph_data(output_path='./network.json')
+            >>> fs.save_networkgraph_data(shared_links='hub')
+        """
+
         # Check inputs
         if nodes not in self.obj_types:
             raise TypeError(f"{nodes} is not a Cyber DEM Object or Action")
         if links not in self.obj_types:
             raise TypeError(f"{links} is not a Cyber DEM Object or Action")
-    
-        # Get the data and put in a d3.js format
-        data = {"nodes": [], "links": []}
-        _, resp = self.query('SELECT id FROM ' + nodes)
-        for node in resp:
-            data_object = self.get(node[0], nodes)
-            info = {'id': data_object.id, 'name': data_object.name}
-            data['nodes'].append(info)
-
-        _, resp = self.query('SELECT id FROM '+ links)
-        link_ids = [i[0] for i in resp]
-
-        _, resp = self.query(
-            'SELECT related_object_1,related_object_2 FROM Relationship')
-        for link in link_ids:
-            related = []
-            for rel in resp:
-                if rel[0] == link:
-                    related.append(rel[1])
-                if rel[1] == link:
-                    related.append(rel[0])
-            comb = combinations(related, 2)
-            for c in comb:
-                data['links'].append({'source':c[0],'target':c[1]})
-
-        # Save to file    
+        if shared_links not in ('clique', 'hub'):
+            raise ValueError(
+                f'{shared_links} is not an acceptable value for '
+                f'shared_links. Choose from clique, hub')
+
         if output_path:
             path = output_path
         else:
             path = os.path.join(self.path, 'd3js_data.json')
+        adjacency = self._adjacency()
+
+        # Write the data in a d3.js format as it is read
         with open(path, 'w') as f:
-            json.dump(data, f)
+            separator = ''
+            f.write('{"nodes": [')
+            for id, name in self.iquery(f'SELECT id,name FROM {nodes}')[1]:
+                f.write(separator + json.dumps({'id': id, 'name': name}))
+                separator = ', '
+            _, link_rows = self.iquery(f'SELECT id,name FROM {links}')
+            if shared_links == 'hub':
+                link_rows = list(link_rows)
+                for id, name in link_rows:
+                    f.write(separator + json.dumps(
+                        {'id': id, 'name': name, 'hub': True}))
+                    separator = ', '
+
+            separator = ''
+            f.write('], "links": [')
+            for link, _ in link_rows:
+                related = adjacency.neighbors(link)
+                if shared_links == 'hub':
+                    pairs = ((link, r) for r in related)
+                else:
+                    pairs = combinations(related, 2)
+                for source, target in pairs:
+                    f.write(separator + json.dumps(
+                        {'source': source, 'target': target}))
+                    separator = ', '
+            f.write(']}')
         f.close()
 
-    def save_flatfile(self, output_path=None, ignore=[]):
-        """Saves objects and actions in the filesystem to one flat json file.
+    def save_networkgraph_clusters(
+            self, group_by='NetworkLink', nodes='Device', links='NetworkLink',
+            output_path=None):
+        """Saves a summary of the network graph as d3.js json, with the
+        nodes grouped into clusters
 
-        :param output_path: location and path to save the flat file (ex.
-            'results\\cd_output.json')
-        :type output_path: string, optional (defaults to filesystem path)
-        :param ignore: list of Cyber DEM objects or actions (as strings) not to
-            indclude in the file
-        :type ignore: list of strings, optional
+        Each node object is put in one cluster, and each cluster is saved as
+        one node with the number of objects in it (``size``). Clusters are
+        linked with a ``weight`` that is the number of links between their
+        objects in the full graph (see :meth:`save_networkgraph_data`), and
+        ``internal_links`` is the number of links within a cluster. The json
+        stays small however many objects there are; the objects in one
+        cluster can be saved with :meth:`save_networkgraph_cluster`, to the
+        ``file`` named in its node.
+
+        :param group_by: a Cyber DEM type to cluster by the object of that
+            type each node is related to (ex. "NetworkLink" for subnets or
+            "System"), choosing the largest if there are several, or the name
+            of an attribute of the nodes to cluster by its value (ex.
+            "device_types")
+        :type group_by: string, optional (default='NetworkLink')
+        :param nodes: Cyber DEM type of the nodes
+        :type nodes: string, optional (default='Device')
+        :param links: Cyber DEM type of the objects that link nodes
+        :type links: string, optional (default='NetworkLink')
+        :param output_path: file to save the summary in
+        :type output_path: string, optional (default is d3js_clusters.json in
+            the FileSystem folder)
 
         :Example:
-            >>> fs = FileSystem('./test-fs')
-            >>> fs.save_flatfile(ignore=['Application'])
+            >>> fs.save_networkgraph_clusters(group_by='device_types')
+            >>> fs.save_networkgraph_cluster(
+            ...     'Printer', group_by='device_types')
         """
 
-        # Check for bad input
-        if not isinstance(ignore, list):
-            raise TypeError("\"ignore\" must be a list of Cyber DEM objects")
-        for obj_type in ignore:
-            if obj_type not in self.obj_types:
-                raise ValueError(
-                    f"{obj_type} in 'ignore' is not a Cyber DEM object or "
+        assignment, names = self._clusters(group_by, nodes, links)
+        sizes = {}
+        for cluster in assignment.values():
+            sizes[cluster] = sizes.get(cluster, 0) + 1
+
+        # the number of pairs of nodes on each link, by pair of clusters
+        weights = {}
+        adjacency = self._adjacency()
+        for link in self._members.get(links, ()):
+            counts = {}
+            for node in adjacency.neighbors(link):
+                cluster = assignment.get(node)
+                if cluster is not None:
+                    counts[cluster] = counts.get(cluster, 0) + 1
+            counts = sorted(counts.items())
+            for i, (first, n) in enumerate(counts):
+                if n > 1:
+                    weights[(first, first)] = \
+                        weights.get((first, first), 0) + n * (n - 1) // 2
+                for second, m in counts[i + 1:]:
+                    weights[(first, second)] = \
+                        weights.get((first, second), 0) + n * m
+
+        if output_path:
+            path = output_path
+        else:
+            path = os.path.join(self.path, 'd3js_clusters.json')
+        with open(path, 'w') as f:
+            separator = ''
+            f.write('{"nodes": [')
+            for cluster in sorted(sizes):
+                f.write(separator + json.dumps({
+                    'id': cluster, 'name': names[cluster],
+                    'size': sizes[cluster],
+                    'internal_links': weights.get((cluster, cluster), 0),
+                    'file': _cluster_filename(cluster)}))
+                separator = ', '
+            separator = ''
+            f.write('], "links": [')
+            for (source, target), weight in weights.items():
+                if source != target:
+                    f.write(separator + json.dumps(
+                        {'source': source, 'target': target,
+                         'weight': weight}))
+                    separator = ', '
+            f.write(']}')
+        f.close()
+
+    def save_networkgraph_cluster(
+            self, cluster, group_by='NetworkLink', nodes='Device',
+            links='NetworkLink', output_path=None, shared_links='clique'):
+        """Saves the network graph of the objects in one cluster of
+        :meth:`save_networkgraph_clusters` as d3.js json
+
+        The objects in the cluster are linked like in
+        :meth:`save_networkgraph_data`. The other clusters they are linked to
+        are added as nodes (with ``"cluster": true`` and their ``size``),
+        linked to each object with a ``weight`` that is the number of links
+        to objects in that cluster. Only the files of the objects in the
+        cluster are read.
+
+        :param cluster: ``id`` of the cluster's node in the summary
+        :type cluster: string, required
+        :param group_by: how the clusters were made (see
+            :meth:`save_networkgraph_clusters`)
+        :type group_by: string, optional (default='NetworkLink')
+        :param nodes: Cyber DEM type of the nodes
+        :type nodes: string, optional (default='Device')
+        :param links: Cyber DEM type of the objects that link nodes
+        :type links: string, optional (default='NetworkLink')
+        :param output_path: file to save the graph in
+        :type output_path: string, optional (default is the ``file`` named in
+            the summary, in the FileSystem folder)
+        :param shared_links: 'clique' or 'hub' (see
+            :meth:`save_networkgraph_data`)
+        :type shared_links: string, optional (default='clique')
+        """
+
+        if shared_links not in ('clique', 'hub'):
+            raise ValueError(
+                f'{shared_links} is not an acceptable value for '
+                f'shared_links. Choose from clique, hub')
+        assignment, names = self._clusters(group_by, nodes, links)
+        members = [id for id, c in assignment.items() if c == cluster]
+        if not members:
+            raise ValueError(f'There is no cluster {cluster}')
+        sizes = {}
+        for c in assignment.values():
+            sizes[c] = sizes.get(c, 0) + 1
+
+        # the links the cluster's objects are on
+        adjacency = self._adjacency()
+        link_ids = self._members.get(links, set())
+        cluster_links = []
+        seen = set()
+        for member in members:
+            for link in adjacency.neighbors(member):
+                if link in link_ids and link not in seen:
+                    seen.add(link)
+                    cluster_links.append(link)
+
+        if output_path:
+            path = output_path
+        else:
+            path = os.path.join(self.path, _cluster_filename(cluster))
+        with open(path, 'w') as f:
+            separator = ''
+            f.write('{"nodes": [')
+            for member in members:
+                obj = self._read(nodes, member) or {}
+                f.write(separator + json.dumps(
+                    {'id': member, 'name': obj.get('name')}))
+                separator = ', '
+
+            # links within the cluster, and counts of links to other clusters
+            pairs = []
+            outside = {}
+            for link in cluster_links:
+                inside = []
+                others = {}
+                for r in adjacency.neighbors(link):
+                    other = assignment.get(r)
+                    if other == cluster:
+                        inside.append(r)
+                    elif other is not None:
+                        others[other] = others.get(other, 0) + 1
+                if shared_links == 'hub':
+                    pairs.extend((link, r) for r in inside)
+                else:
+                    pairs.extend(combinations(inside, 2))
+                for member in inside:
+                    for other, n in others.items():
+                        outside[(member, other)] = \
+                            outside.get((member, other), 0) + n
+            if shared_links == 'hub':
+                for link in cluster_links:
+                    obj = self._read(links, link) or {}
+                    f.write(separator + json.dumps(
+                        {'id': link, 'name': obj.get('name'), 'hub': True}))
+            for other in sorted({o for _, o in outside}):
+                f.write(separator + json.dumps(
+                    {'id': other, 'name': names[other], 'size': sizes[other],
+                     'cluster': True, 'file': _cluster_filename(other)}))
+
+            separator = ''
+            f.write('], "links": [')
+            for source, target in pairs:
+                f.write(separator + json.dumps(
+                    {'source': source, 'target': target}))
+                separator = ', '
+            for (member, other), weight in outside.items():
+                f.write(separator + json.dumps(
+                    {'source': member, 'target': other, 'weight': weight}))
+                separator = ', '
+            f.write(']}')
+        f.close()
+
+    def _clusters(self, group_by, nodes, links):
+        """Puts each object of the ``nodes`` type in one cluster
+
+        :return: dict of node ID -> cluster ID, and dict of cluster ID ->
+            cluster name
+        """
+
+        for obj_type in (nodes, links):
+            if obj_type not in self.obj_types:
+                raise TypeError(
+                    f"{obj_type} is not a Cyber DEM Object or Action")
+        node_ids = self._members.get(nodes, set())
+        assignment = {}
+        names = {}
+        if group_by in self.obj_types:
+            # each node joins the largest group it is related to
+            adjacency = self._adjacency()
+            best = {}
+            for group, name in self.iquery(
+                    f'SELECT id,name FROM {group_by}')[1]:
+                names[group] = name if name is not None else group
+                related = [
+                    n for n in adjacency.neighbors(group) if n in node_ids]
+                rank = (-len(related), group)
+                for node in related:
+                    if node not in best or rank < best[node]:
+                        best[node] = rank
+            for node, (_, group) in best.items():
+                assignment[node] = group
+        else:
+            for id, value in self.iquery(
+                    f'SELECT id,{group_by} FROM {nodes}')[1]:
+                if isinstance(value, list):
+                    value = ','.join(str(v) for v in value)
+                if value is not None:
+                    assignment[id] = names[str(value)] = str(value)
+        for node in node_ids:
+            if node not in assignment:
+                assignment[node] = names[_UNGROUPED] = _UNGROUPED
+        return assignment, names
+
+    def export_graph(
+            self, output_path=None, relationship_types=None, direction='out'):
+        """Saves the Relationships as a binary compressed sparse row graph
+
+        The objects are numbered, and the file holds the neighbors of every
+        object (``targets[offsets[n]:offsets[n+1]]``), the type of each of
+        those Relationships as a code, and the IDs of the objects, as raw
+        arrays (see :meth:`cyberdem.graph.Graph.save`). Opening the file with
+        :meth:`cyberdem.graph.Graph.load` maps it into memory instead of
+        reading it, so even a graph of millions of Relationships opens in
+        milliseconds.
+
+        :param output_path: location and path to save the graph (ex.
+            'results\\network.graph')
+        :type output_path: string, optional (defaults to filesystem path)
+        :param relationship_types: only include Relationships of these types;
+            put None in the list to include Relationships that don't have a
+            type
+        :type relationship_types: list of strings, optional (default is every
+            type)
+        :param direction: 'out' for edges from ``related_object_1`` to
+            ``related_object_2``, 'in' for the other way, or 'both'
+        :type direction: string, optional (default='out')
+
+        :Example:
+            >>> fs.export_graph('./network.graph')
+            >>> from cyberdem.graph import Graph
+            >>> graph = Graph.load('./network.graph')
+        """
+
+        if output_path:
+            path = output_path
+        else:
+            path = os.path.join(self.path, 'cyberdem_graph.bin')
+        Graph(self, relationship_types, direction).save(path)
+
+    def save_flatfile(self, output_path=None, ignore=[]):
+        """Saves objects and actions in the filesystem to one flat json file.
+
+        :param output_path: location and path to save the flat file (ex.
+            'results\\cd_output.json')
+        :type output_path: string, optional (defaults to filesystem path)
+        :param ignore: list of Cyber DEM objects or actions (as strings) not to
+            indclude in the file
+        :type ignore: list of strings, optional
+
+        :Example:
+            >>> fs = FileSystem('./test-fs')
+            >>> fs.save_flatfile(ignore=['Application'])
+        """
+
+        # Check for bad input
+        if not isinstance(ignore, list):
+            raise TypeError("\"ignore\" must be a list of Cyber DEM objects")
+        for obj_type in ignore:
+            if obj_type not in self.obj_types:
+                raise ValueError(
+                    f"{obj_type} in 'ignore' is not a Cyber DEM object or "
                     f"action")
 
         # iterate through all folders in the file path and add objects to data
         data = {} 
-        for folder in os.listdir(self.path):
+        for folder in self._folders:
             if folder in ignore:
                 continue
             data[folder] = []
@@ -426,4 +1932,1551 @@ class FileSystem():
             path = os.path.join(self.path, 'cyberdem_data.json')
         with open(path, 'w') as f:
             json.dump(data, f)
-        f.close()
\ No newline at end of file
+        f.close()
+
+
+# cluster of the objects that aren't in any group in a clustered graph
+_UNGROUPED = 'ungrouped'
+
+
+def _cluster_filename(cluster):
+    """Name of the file a cluster's graph is saved in by default"""
+
+    return 'd3js_cluster_' + re.sub(r'[^\w.-]', '_', cluster) + '.json'
+
+
+# Query language
+#
+# Query strings are tokenized and parsed once into a small tree of tuples, and
+# the WHERE clause is compiled into a Python closure that is reused for every
+# object that is scanned.
+#
+#   ('or', [node, ...]), ('and', [node, ...]), ('not', node),
+#   ('cmp', op, ('col', name), ('lit', value)),
+#   ('cmp', op, ('col', name), ('col', name)),
+#   ('in', ('col', name), [value, ...], negated),
+#   ('like', ('col', name), pattern, negated)
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+        |(?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.]))
+        |(?P<op><>|!=|==|<=|>=|=|<|>)
+        |(?P<punct>[(),;*])
+        |(?P<name>[A-Za-z_][\w.]*)
+    )""", re.VERBOSE)
+
+_KEYWORDS = {
+    'EXPLAIN', 'SELECT', 'FROM', 'WHERE', 'AND', 'OR', 'NOT', 'IN', 'LIKE',
+    'BETWEEN', 'IS', 'NULL', 'TRUE', 'FALSE', 'NONE', 'JOIN', 'ON', 'AS',
+    'GROUP', 'ORDER', 'BY', 'ASC', 'DESC', 'LIMIT', 'OFFSET'}
+
+_AGGREGATES = ('COUNT', 'MIN', 'MAX', 'SUM', 'AVG')
+
+_OPERATORS = {
+    '=': operator.eq, '<>': operator.ne, '<': operator.lt, '>': operator.gt,
+    '<=': operator.le, '>=': operator.ge}
+
+# operator to use when the two sides of a comparison are swapped
+_FLIPPED = {'=': '=', '<>': '<>', '<': '>', '>': '<', '<=': '>=', '>=': '<='}
+
+
+def _tokenize(query_string):
+    """Splits a query string into (kind, value) tokens"""
+
+    tokens = []
+    pos = 0
+    query_string = query_string.rstrip()
+    while pos < len(query_string):
+        match = _TOKEN_RE.match(query_string, pos)
+        if match is None or match.end() == pos:
+            raise ValueError(
+                f'Unrecognized text in query at '
+                f'"{query_string[pos:].strip()}"')
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1].replace(value[0] * 2, value[0])
+        elif kind == 'number':
+            value = float(value) if any(c in value for c in '.eE') \
+                else int(value)
+        elif kind == 'op':
+            value = {'==': '=', '!=': '<>'}.get(value, value)
+        elif kind == 'name' and value.upper() in _KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Query():
+    """Parsed form of a query string"""
+
+    def __init__(self):
+        self.explain = False
+        self.select = []  # attribute names and (function, attribute) pairs
+        self.from_types = []
+        self.tables = []  # (alias, obj_type) pairs, if there are JOINs
+        self.joins = []  # (attribute, earlier alias, its attribute) per JOIN
+        self.where = None
+        self.group_by = []
+        self.order_by = []  # (attribute name, descending) pairs
+        self.limit = None
+        self.offset = 0
+
+    @property
+    def aggregates(self):
+        """The (function, attribute) pairs in the SELECT"""
+
+        return [item for item in self.select if isinstance(item, tuple)]
+
+    def resolve(self, name):
+        """The (alias, attribute) a column name refers to in a JOIN query
+
+        Names without an alias (ex. ``name`` rather than ``Device.name``)
+        refer to the first table.
+        """
+
+        if '.' in name:
+            alias, attr = name.split('.', 1)
+            if alias not in [a for a, _ in self.tables]:
+                raise ValueError(f'Unknown table "{alias}" in {name}')
+            return alias, attr
+        return self.tables[0][0], name
+
+    @property
+    def headers(self):
+        """Names of the result columns, ex. ``'COUNT(*)'`` for aggregates"""
+
+        return [
+            f'{item[0]}({item[1]})' if isinstance(item, tuple) else item
+            for item in self.select]
+
+
+class _QueryParser():
+    """Recursive descent parser for the FileSystem query language"""
+
+    def __init__(self, query_string):
+        self.query_string = query_string
+        self.tokens = _tokenize(query_string)
+        self.pos = 0
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _accept(self, kind, value=None):
+        token = self._peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.pos += 1
+            return True
+        return False
+
+    def _expect(self, kind, value=None):
+        if not self._accept(kind, value):
+            found = self._peek()[1]
+            raise ValueError(
+                f'Expected {value or kind} but found "{found}" in query '
+                f'"{self.query_string}"')
+        return self.tokens[self.pos - 1][1]
+
+    def parse(self):
+        query = _Query()
+        query.explain = self._accept('keyword', 'EXPLAIN')
+        if not self._accept('keyword', 'SELECT'):
+            raise Exception(
+                f'query_string must start with "SELECT ". {self.query_string}')
+        query.select = self._select_list()
+        if not self._accept('keyword', 'FROM'):
+            raise Exception(
+                f'query_string must contain "FROM" statement. '
+                f'{self.query_string}')
+        query.from_types = self._from_list(query)
+        if self._accept('keyword', 'WHERE'):
+            query.where = self._or()
+        if self._accept('keyword', 'GROUP'):
+            self._expect('keyword', 'BY')
+            query.group_by = self._name_list()
+        if query.group_by or query.aggregates:
+            for item in query.select:
+                if not isinstance(item, tuple) and item not in query.group_by:
+                    raise ValueError(
+                        f'{item} must be in the GROUP BY or an aggregate in '
+                        f'query "{self.query_string}"')
+        if self._accept('keyword', 'ORDER'):
+            self._expect('keyword', 'BY')
+            query.order_by = [self._order_item()]
+            while self._accept('punct', ','):
+                query.order_by.append(self._order_item())
+        if self._accept('keyword', 'LIMIT'):
+            query.limit = self._count('LIMIT')
+        if self._accept('keyword', 'OFFSET'):
+            query.offset = self._count('OFFSET')
+        self._accept('punct', ';')
+        if self.pos < len(self.tokens):
+            raise ValueError(
+                f'Unexpected "{self._peek()[1]}" in query '
+                f'"{self.query_string}"')
+        return query
+
+    def _count(self, keyword):
+        kind, value = self._next()
+        if kind != 'number' or not isinstance(value, int) or value < 0:
+            raise ValueError(
+                f'{keyword} must be followed by a non-negative integer in '
+                f'query "{self.query_string}"')
+        return value
+
+    def _name_list(self):
+        names = [self._expect('name')]
+        while self._accept('punct', ','):
+            names.append(self._expect('name'))
+        return names
+
+    def _from_list(self, query):
+        if self._accept('punct', '*'):
+            return ['*']
+        obj_type = self._expect('name')
+        alias = self._alias(obj_type)
+        if self._peek() != ('keyword', 'JOIN'):
+            if alias != obj_type:
+                raise ValueError(
+                    f'Table aliases can only be used with JOIN in query '
+                    f'"{self.query_string}"')
+            names = [obj_type]
+            while self._accept('punct', ','):
+                names.append(self._expect('name'))
+            return names
+
+        query.tables.append((alias, obj_type))
+        while self._accept('keyword', 'JOIN'):
+            obj_type = self._expect('name')
+            alias = self._alias(obj_type)
+            if alias in [a for a, _ in query.tables]:
+                raise ValueError(
+                    f'Table "{alias}" is joined twice (use an alias, ex. '
+                    f'"JOIN {obj_type} AS t2") in query "{self.query_string}"')
+            query.tables.append((alias, obj_type))
+            if self._accept('keyword', 'ON'):
+                left = query.resolve(self._expect('name'))
+                self._expect('op', '=')
+                right = query.resolve(self._expect('name'))
+                if right[0] == alias:
+                    left, right = right, left
+                if left[0] != alias or right[0] == alias:
+                    raise ValueError(
+                        f'JOIN {alias} must be ON one of its attributes = an '
+                        f'attribute of an earlier table in query '
+                        f'"{self.query_string}"')
+                query.joins.append((left[1], right[0], right[1]))
+                continue
+            # after a Relationship, JOIN the object at its other end
+            previous, previous_type = query.tables[-2]
+            ends = ('related_object_1', 'related_object_2')
+            if previous_type != 'Relationship' or len(query.tables) < 3 or \
+                    query.joins[-1][0] not in ends:
+                raise ValueError(
+                    f'JOIN {obj_type} needs an ON condition in query '
+                    f'"{self.query_string}"')
+            other = ends[1 - ends.index(query.joins[-1][0])]
+            query.joins.append(('id', previous, other))
+        return [t for _, t in query.tables]
+
+    def _alias(self, obj_type):
+        if self._accept('keyword', 'AS'):
+            return self._expect('name')
+        if self._peek()[0] == 'name':
+            return self._next()[1]
+        return obj_type
+
+    def _select_list(self):
+        if self._accept('punct', '*'):
+            return ['*']
+        items = [self._select_item()]
+        while self._accept('punct', ','):
+            items.append(self._select_item())
+        return items
+
+    def _select_item(self):
+        name = self._expect('name')
+        if name.upper() not in _AGGREGATES or \
+                not self._accept('punct', '('):
+            return name
+        func = name.upper()
+        if func == 'COUNT' and self._accept('punct', '*'):
+            attr = '*'
+        else:
+            attr = self._expect('name')
+        self._expect('punct', ')')
+        return (func, attr)
+
+    def _order_item(self):
+        name = self._select_item()
+        if isinstance(name, tuple):
+            name = f'{name[0]}({name[1]})'
+        if self._accept('keyword', 'DESC'):
+            return (name, True)
+        self._accept('keyword', 'ASC')
+        return (name, False)
+
+    def _or(self):
+        nodes = [self._and()]
+        while self._accept('keyword', 'OR'):
+            nodes.append(self._and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def _and(self):
+        nodes = [self._not()]
+        while self._accept('keyword', 'AND'):
+            nodes.append(self._not())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def _not(self):
+        if self._accept('keyword', 'NOT'):
+            return ('not', self._not())
+        return self._predicate()
+
+    def _predicate(self):
+        if self._accept('punct', '('):
+            node = self._or()
+            self._expect('punct', ')')
+            return node
+
+        left = self._operand()
+        negated = self._accept('keyword', 'NOT')
+        if self._accept('keyword', 'IN'):
+            self._expect('punct', '(')
+            values = [self._literal()]
+            while self._accept('punct', ','):
+                values.append(self._literal())
+            self._expect('punct', ')')
+            return ('in', self._column(left), values, negated)
+        if self._accept('keyword', 'LIKE'):
+            pattern = self._literal()
+            if not isinstance(pattern, str):
+                raise ValueError(f'LIKE pattern {pattern} must be a string')
+            return ('like', self._column(left), pattern, negated)
+        if negated:
+            raise ValueError(
+                f'Expected IN or LIKE after NOT in "{self.query_string}"')
+        if self._accept('keyword', 'BETWEEN'):
+            low = self._literal()
+            self._expect('keyword', 'AND')
+            high = self._literal()
+            column = self._column(left)
+            return ('and', [
+                ('cmp', '>=', column, ('lit', low)),
+                ('cmp', '<=', column, ('lit', high))])
+        if self._accept('keyword', 'IS'):
+            op = '<>' if self._accept('keyword', 'NOT') else '='
+            self._expect('keyword', 'NULL')
+            return ('cmp', op, self._column(left), ('lit', None))
+
+        op = self._expect('op')
+        right = self._operand()
+        if left[0] == 'lit' and right[0] == 'col':
+            left, right, op = right, left, _FLIPPED[op]
+        return ('cmp', op, left, right)
+
+    def _operand(self):
+        kind, value = self._peek()
+        if kind == 'name':
+            self.pos += 1
+            return ('col', value)
+        return ('lit', self._literal())
+
+    def _literal(self):
+        kind, value = self._next()
+        if kind in ('string', 'number'):
+            return value
+        if kind == 'keyword' and value in ('TRUE', 'FALSE'):
+            return value == 'TRUE'
+        if kind == 'keyword' and value in ('NULL', 'NONE'):
+            return None
+        raise ValueError(
+            f'Expected a value but found "{value}" in query '
+            f'"{self.query_string}"')
+
+    def _column(self, operand):
+        if operand[0] != 'col':
+            raise ValueError(
+                f'Expected an attribute name but found {operand[1]!r} in '
+                f'query "{self.query_string}"')
+        return operand
+
+
+def _parse_query(query_string):
+    """Parses a query string into a :class:`_Query`"""
+
+    return _QueryParser(query_string).parse()
+
+
+@lru_cache(maxsize=4096)
+def _as_datetime(value):
+    """Parses an ISO formatted date string, or returns None"""
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _as_number(value):
+    """Parses a numeric string, or returns None"""
+
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+def _literal_forms(literal):
+    """The number and datetime a query literal can also be compared as"""
+
+    if isinstance(literal, str):
+        return _as_number(literal), _as_datetime(literal)
+    if literal is True or literal is False:
+        return None, None
+    return literal, None
+
+
+def _compare(op, value, literal, number, moment):
+    """Compares an attribute value to a literal by type
+
+    Values that can't be compared to the literal (including missing values)
+    only satisfy ``<>``.
+    """
+
+    cls = value.__class__
+    if cls is str:
+        if moment is not None:
+            value_moment = _as_datetime(value)
+            if value_moment is not None:
+                try:
+                    return _OPERATORS[op](value_moment, moment)
+                except TypeError:
+                    # naive vs. timezone aware datetimes
+                    return op == '<>'
+        if literal.__class__ is str:
+            return _OPERATORS[op](value, literal)
+    elif (cls is int or cls is float) and number is not None:
+        return _OPERATORS[op](value, number)
+    elif cls is bool and literal.__class__ is bool and op in ('=', '<>'):
+        return _OPERATORS[op](value, literal)
+    return op == '<>'
+
+
+def _hash_key(value):
+    """A hashable key for a value that keeps booleans, numbers, and strings
+    distinct (``True == 1`` in Python, but not in a query)"""
+
+    cls = value.__class__
+    if cls is str:
+        return ('s', value)
+    if cls is bool:
+        return ('b', value)
+    if cls is int or cls is float:
+        return ('n', value)
+    if value is None:
+        return ('z', None)
+    return ('j', json.dumps(value, sort_keys=True))
+
+
+def _hash_value(key):
+    """The value a :func:`_hash_key` was made from"""
+
+    if key[0] == 'j':
+        return json.loads(key[1])
+    return key[1]
+
+
+def _sort_key(value):
+    """A key that orders any (non-null) attribute values for ORDER BY
+
+    Numbers come first, then dates, dates with a timezone, other strings,
+    booleans, and anything else, so values that :func:`_compare` can compare
+    sort the same way they compare, and in the same order as the lists of a
+    :class:`_RangeIndex`.
+    """
+
+    entry = _RangeIndex._domain(value)
+    if entry is not None:
+        return (_RangeIndex._domains.index(entry[0]), entry[1])
+    if value is True or value is False:
+        return (4, value)
+    return (5, json.dumps(value, sort_keys=True))
+
+
+class _Descending():
+    """Wraps a sort key to reverse its order"""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+def _order_key(positions):
+    """Compiles an ORDER BY into a sort key for result rows
+
+    :param positions: (position in the row, descending) pairs
+    :return: function giving the sort key of a row; objects that don't have
+        an attribute come last whether it is sorted ascending or descending
+    """
+
+    def key(row):
+        keys = []
+        for pos, descending in positions:
+            value = row[pos]
+            if value is None:
+                keys.append((1,))
+            elif descending:
+                keys.append((0, _Descending(_sort_key(value))))
+            else:
+                keys.append((0, _sort_key(value)))
+        return keys
+    return key
+
+
+class _Aggregate():
+    """Running value of one aggregate function over the rows of a group
+
+    ``MIN`` and ``MAX`` compare values like ``ORDER BY`` does, ``SUM`` and
+    ``AVG`` only use numbers, and every function but ``COUNT(*)`` skips
+    objects that don't have the attribute.
+
+    :param func: one of ``_AGGREGATES``
+    """
+
+    __slots__ = ('func', 'count', 'total', 'best', 'best_key')
+
+    def __init__(self, func):
+        self.func = func
+        self.count = 0
+        self.total = 0
+        self.best = None
+        self.best_key = None
+
+    def add(self, value):
+        if value is None:
+            return
+        func = self.func
+        if func == 'COUNT':
+            self.count += 1
+        elif func == 'SUM' or func == 'AVG':
+            cls = value.__class__
+            if cls is int or cls is float:
+                self.count += 1
+                self.total += value
+        else:
+            key = _sort_key(value)
+            if self.best_key is None or (
+                    key < self.best_key if func == 'MIN'
+                    else self.best_key < key):
+                self.best, self.best_key = value, key
+
+    def result(self):
+        if self.func == 'COUNT':
+            return self.count
+        if self.func in ('SUM', 'AVG'):
+            if not self.count:
+                return None
+            if self.func == 'AVG':
+                return self.total / self.count
+            return self.total
+        return self.best
+
+
+def _like_regex(pattern):
+    """Translates a LIKE pattern into a compiled regular expression"""
+
+    regex = ''.join(
+        '.*' if c == '%' else '.' if c == '_' else re.escape(c)
+        for c in pattern)
+    return re.compile(regex, re.DOTALL)
+
+
+def _column_getter(name):
+    """Returns a function that reads an attribute from an object dict"""
+
+    def get(obj):
+        return obj.get(name)
+    return get
+
+
+def _compile_where(node, getter=_column_getter):
+    """Compiles a parsed WHERE clause into a function of one object dict
+
+    :param node: parsed WHERE clause
+    :param getter: function that takes an attribute name and returns a
+        function reading that attribute from the objects being filtered
+    :return: function returning True if the object matches the clause
+    """
+
+    kind = node[0]
+    if kind in ('and', 'or'):
+        parts = [_compile_where(n, getter) for n in node[1]]
+        if kind == 'and':
+            def matches(obj):
+                for part in parts:
+                    if not part(obj):
+                        return False
+                return True
+        else:
+            def matches(obj):
+                for part in parts:
+                    if part(obj):
+                        return True
+                return False
+        return matches
+
+    if kind == 'not':
+        part = _compile_where(node[1], getter)
+        return lambda obj: not part(obj)
+
+    if kind == 'in':
+        get, negated = getter(node[1][1]), node[3]
+        keys = set()
+        moments = set()
+        for literal in node[2]:
+            keys.add(_hash_key(literal))
+            number, moment = _literal_forms(literal)
+            if number is not None:
+                keys.add(_hash_key(number))
+            if moment is not None:
+                moments.add(moment)
+
+        def matches(obj):
+            value = get(obj)
+            found = _hash_key(value) in keys
+            if not found and moments and value.__class__ is str:
+                found = _as_datetime(value) in moments
+            return found != negated
+        return matches
+
+    if kind == 'like':
+        get, negated = getter(node[1][1]), node[3]
+        regex = _like_regex(node[2])
+
+        def matches(obj):
+            value = get(obj)
+            found = value.__class__ is str and \
+                regex.fullmatch(value) is not None
+            return found != negated
+        return matches
+
+    if kind == 'cmp':
+        op, left, right = node[1:]
+        if left[0] == 'lit':
+            result = _compare(op, left[1], right[1], *_literal_forms(right[1]))
+            return lambda obj: result
+        get = getter(left[1])
+        if right[0] == 'lit':
+            literal = right[1]
+            if literal is None:
+                if op == '=':
+                    return lambda obj: get(obj) is None
+                if op == '<>':
+                    return lambda obj: get(obj) is not None
+                return lambda obj: False
+            number, moment = _literal_forms(literal)
+            return lambda obj: _compare(op, get(obj), literal, number, moment)
+        # comparing two attributes of the same object
+        get_other = getter(right[1])
+
+        def matches(obj):
+            other = get_other(obj)
+            if other is None:
+                return op == '<>'
+            return _compare(op, get(obj), other, *_literal_forms(other))
+        return matches
+
+    raise ValueError(f'Unknown query clause {node}')
+
+
+# Query planning
+
+# relative cost of reading and decoding one object file, compared to taking
+# one ID out of an index
+_FILE_COST = 100
+
+# fewest object files worth splitting across worker processes
+_PARALLEL_MIN = 1024
+
+
+class _IndexLookup():
+    """A way of finding the IDs that can match (part of) a WHERE clause with
+    the attribute indexes
+
+    :param description: text shown by ``EXPLAIN``
+    :param rows: (estimated) number of IDs the lookup returns
+    :param cost: number of IDs taken out of the indexes
+    :param fetch: function returning the set of IDs
+    """
+
+    def __init__(self, description, rows, cost, fetch):
+        self.description = description
+        self.rows = rows
+        self.cost = cost
+        self.fetch = fetch
+
+    @classmethod
+    def hash(cls, index, keys):
+        rows = sum(len(index.lookup(k)) for k in keys)
+
+        def fetch():
+            found = set()
+            for key in keys:
+                found |= index.lookup(key)
+            return found
+        return cls(f'hash({index.attr})', rows, rows, fetch)
+
+    @classmethod
+    def range(cls, index, conditions):
+        rows = index.count(conditions)
+        if rows is None:
+            return None
+        return cls(
+            f'range({index.attr})', rows, rows,
+            lambda: index.search(conditions))
+
+    @classmethod
+    def intersection(cls, lookups, rows):
+        def fetch():
+            found = lookups[0].fetch()
+            for lookup in lookups[1:]:
+                found &= lookup.fetch()
+            return found
+        return cls(
+            ' AND '.join(l.description for l in lookups), int(ceil(rows)),
+            sum(l.cost for l in lookups), fetch)
+
+    @classmethod
+    def union(cls, lookups, total):
+        def fetch():
+            found = set()
+            for lookup in lookups:
+                found |= lookup.fetch()
+            return found
+        return cls(
+            '(' + ' OR '.join(l.description for l in lookups) + ')',
+            min(total, sum(l.rows for l in lookups)),
+            sum(l.cost for l in lookups), fetch)
+
+
+class _ScanStats():
+    """Counts the work done reading object files"""
+
+    def __init__(self):
+        self.files_opened = 0
+        self.bytes_read = 0
+        self.objects_decoded = 0
+
+    def add(self, other):
+        self.files_opened += other.files_opened
+        self.bytes_read += other.bytes_read
+        self.objects_decoded += other.objects_decoded
+
+
+class _Plan(_ScanStats):
+    """How the objects of one type are read for a query, and what reading
+    them cost
+
+    :param obj_type: Cyber DEM type being read
+    :param lookup: :class:`_IndexLookup` to use, or None for a full scan
+    :param total: number of objects of the type
+    :param columns: column indexes to read attributes from, by attribute
+        name, or None to read everything from the object files
+    :param read_files: False if the columns have every selected attribute
+    :param then: what is done with the rows after they are read (ex. an ORDER
+        BY sort), for ``EXPLAIN``
+    :param virtual: True if the objects are made from virtual networks
+        rather than read
+    """
+
+    headers = (
+        'obj_type', 'access', 'estimated_rows', 'files_opened', 'bytes_read',
+        'objects_decoded', 'rows')
+    # attributes that are known without reading an object's file
+    builtin_columns = ('id', '_type')
+
+    def __init__(
+            self, obj_type, lookup, total, columns=None, read_files=True,
+            then=None, virtual=False):
+        super().__init__()
+        self.obj_type = obj_type
+        self.lookup = lookup
+        self.estimated_rows = lookup.rows if lookup else total
+        self.columns = columns
+        self.read_files = read_files
+        self.then = then
+        self.virtual = virtual
+        self.rows = 0
+
+    def explain(self):
+        if self.virtual:
+            access = 'virtual objects'
+        elif self.lookup is None:
+            access = 'full scan'
+        else:
+            access = 'index ' + self.lookup.description
+        if self.columns is not None:
+            access += ' using columns(' + ','.join(
+                sorted(self.columns) or self.builtin_columns) + ')'
+            if self.read_files:
+                access += ' then files'
+        if self.then is not None:
+            access += ' then ' + self.then
+        return (
+            self.obj_type, access, self.estimated_rows, self.files_opened,
+            self.bytes_read, self.objects_decoded, self.rows)
+
+
+def _column_dict(obj_type, id, columns):
+    """An object dict with only the attributes in the column indexes"""
+
+    obj_dict = {'id': id, '_type': obj_type}
+    for attr, column in columns.items():
+        value = column.get(id)
+        if value is not None:
+            obj_dict[attr] = value
+    return obj_dict
+
+
+def _read_objects(folder, ids, stats):
+    """Reads and decodes the object files for a list of IDs, skipping any
+    that no longer exist
+
+    :param folder: folder of one object type
+    :param ids: IDs of the objects to read
+    :param stats: :class:`_ScanStats` to count the work in
+    """
+
+    for id in ids:
+        try:
+            with open(os.path.join(folder, id + '.json'), 'rb') as json_file:
+                data = json_file.read()
+        except FileNotFoundError:
+            continue
+        json_file.close()
+        stats.files_opened += 1
+        stats.bytes_read += len(data)
+        obj_dict = json.loads(data)
+        stats.objects_decoded += 1
+        yield obj_dict
+
+
+def _scan_files(folder, ids, where, get_attrs):
+    """Reads and filters a chunk of object files in a worker process
+
+    The parsed WHERE clause is compiled in the worker, since compiled clauses
+    can't be sent between processes.
+
+    :return: selected attributes of the matching objects, and the
+        :class:`_ScanStats` for the chunk
+    """
+
+    matches = _compile_where(where) if where is not None else None
+    stats = _ScanStats()
+    rows = []
+    for obj_dict in _read_objects(folder, ids, stats):
+        if matches is None or matches(obj_dict):
+            rows.append(tuple(obj_dict.get(a) for a in get_attrs))
+    return rows, stats
+
+
+def _where_attrs(node):
+    """Names of the attributes used in a parsed WHERE clause"""
+
+    if node[0] in ('and', 'or'):
+        return set().union(*[_where_attrs(n) for n in node[1]])
+    if node[0] == 'not':
+        return _where_attrs(node[1])
+    attrs = {node[2][1]} if node[0] == 'cmp' and node[2][0] == 'col' else set()
+    if node[0] == 'cmp' and node[3][0] == 'col':
+        attrs.add(node[3][1])
+    if node[0] in ('in', 'like'):
+        attrs.add(node[1][1])
+    return attrs
+
+
+def _map_columns(node, rename):
+    """Copies a parsed WHERE clause with its attribute names renamed"""
+
+    kind = node[0]
+    if kind in ('and', 'or'):
+        return (kind, [_map_columns(n, rename) for n in node[1]])
+    if kind == 'not':
+        return ('not', _map_columns(node[1], rename))
+    if kind == 'cmp':
+        return ('cmp', node[1]) + tuple(
+            ('col', rename(side[1])) if side[0] == 'col' else side
+            for side in node[2:])
+    return (kind, ('col', rename(node[1][1]))) + node[2:]
+
+
+def _probe(rows, hash_table, pos):
+    """Joins rows to the rows of a hash table whose key is the value at
+    ``pos`` in the row"""
+
+    for row in rows:
+        value = row[pos]
+        if value is not None:
+            for match in hash_table.get(_hash_key(value), ()):
+                yield row + match
+
+
+def _copy(value):
+    """Copies list and dict values, so results don't share them with an
+    index"""
+
+    if isinstance(value, (list, dict)):
+        return deepcopy(value)
+    return value
+
+
+# Attribute indexes
+
+
+class _HashIndex():
+    """Maps the values of one attribute of one object type to object IDs
+
+    :param obj_type: Cyber DEM type of the indexed objects
+    :param attr: name of the indexed attribute
+    """
+
+    kind = 'hash'
+
+    def __init__(self, obj_type, attr):
+        self.obj_type = obj_type
+        self.attr = attr
+        self.key = (obj_type, attr, self.kind)
+        self.filename = f'{obj_type}.{attr}.{self.kind}.json'
+        self.dirty = False
+        self.clear()
+
+    def clear(self):
+        self._ids = {}  # hash key -> set of ids
+        self._keys = {}  # id -> hash key
+        self.dirty = True
+
+    def add(self, id, obj_dict):
+        """Indexes (or re-indexes) an object"""
+
+        self.remove(id)
+        if self.attr in obj_dict and obj_dict[self.attr] is not None:
+            key = _hash_key(obj_dict[self.attr])
+            self._keys[id] = key
+            self._ids.setdefault(key, set()).add(id)
+        self.dirty = True
+
+    def remove(self, id):
+        key = self._keys.pop(id, None)
+        if key is not None:
+            self._ids[key].discard(id)
+            if not self._ids[key]:
+                del self._ids[key]
+            self.dirty = True
+
+    def finish(self):
+        """Called after the index is filled by :meth:`add` from scratch"""
+
+        pass
+
+    def lookup(self, key):
+        """IDs of the objects whose value has the given hash key"""
+
+        return self._ids.get(key, set())
+
+    def dump(self):
+        return [[k[0], k[1], sorted(ids)] for k, ids in self._ids.items()]
+
+    def load(self, entries):
+        self.clear()
+        for tag, value, ids in entries:
+            key = (tag, value)
+            self._ids[key] = set(ids)
+            for id in ids:
+                self._keys[id] = key
+        self.dirty = False
+
+
+class _RangeIndex():
+    """Keeps the values of one attribute of one object type sorted
+
+    Values are kept in separate sorted lists by how :func:`_compare` compares
+    them: numbers (``'n'``), strings that are dates (``'d'``, or ``'a'`` if
+    they have a timezone), and other strings (``'s'``). Each list holds
+    ``(value, id)`` tuples, so a range of values is found with two bisects.
+
+    :param obj_type: Cyber DEM type of the indexed objects
+    :param attr: name of the indexed attribute
+    """
+
+    kind = 'range'
+    operators = ('=', '<', '>', '<=', '>=')
+    _domains = ('n', 'd', 'a', 's')
+    _last_id = chr(0x10FFFF)  # sorts after any id
+
+    def __init__(self, obj_type, attr):
+        self.obj_type = obj_type
+        self.attr = attr
+        self.key = (obj_type, attr, self.kind)
+        self.filename = f'{obj_type}.{attr}.{self.kind}.json'
+        self.dirty = False
+        self.clear()
+
+    def clear(self):
+        self._sorted = {d: [] for d in self._domains}
+        self._keys = {}  # id -> (domain, value)
+        self._building = True
+        self.dirty = True
+
+    @staticmethod
+    def _domain(value):
+        """The (domain, sort key) of an attribute value, or None"""
+
+        cls = value.__class__
+        if cls is int or cls is float:
+            if value != value:  # NaN doesn't compare to anything
+                return None
+            return ('n', value)
+        if cls is str:
+            moment = _as_datetime(value)
+            if moment is None:
+                return ('s', value)
+            return ('d' if moment.tzinfo is None else 'a', moment)
+        return None
+
+    def add(self, id, obj_dict):
+        """Indexes (or re-indexes) an object"""
+
+        if not self._building:
+            self.remove(id)
+        entry = self._domain(obj_dict.get(self.attr))
+        if entry is not None:
+            self._keys[id] = entry
+            if self._building:
+                self._sorted[entry[0]].append((entry[1], id))
+            else:
+                insort(self._sorted[entry[0]], (entry[1], id))
+        self.dirty = True
+
+    def finish(self):
+        """Sorts the values added since the index was cleared"""
+
+        for values in self._sorted.values():
+            values.sort()
+        self._building = False
+
+    def ordered(self, descending=False):
+        """Yields the IDs of the indexed objects in the order of their
+        values (see :func:`_sort_key`)"""
+
+        domains = self._domains[::-1] if descending else self._domains
+        for domain in domains:
+            # a copy, so saving objects while the IDs are read is safe
+            values = self._sorted[domain][:]
+            if descending:
+                values.reverse()
+            for _, id in values:
+                yield id
+
+    def remove(self, id):
+        entry = self._keys.pop(id, None)
+        if entry is not None:
+            values = self._sorted[entry[0]]
+            i = bisect_left(values, (entry[1], id))
+            if i < len(values) and values[i] == (entry[1], id):
+                del values[i]
+            self.dirty = True
+
+    def _slices(self, conditions):
+        """The parts of the sorted lists that satisfy every condition
+
+        :param conditions: (operator, literal) pairs from a WHERE clause
+        :return: list of (sorted list, start, end), or None if the index
+            can't answer exactly
+        """
+
+        bounds = []
+        for op, literal in conditions:
+            number, moment = _literal_forms(literal)
+            if isinstance(literal, str) and moment is None and \
+                    (self._sorted['d'] or self._sorted['a']):
+                # dates compare to non-date strings as strings
+                return None
+            bounds.append((op, {
+                'n': number,
+                'd': moment if moment and moment.tzinfo is None else None,
+                'a': moment if moment and moment.tzinfo is not None else None,
+                's': literal if isinstance(literal, str) else None}))
+
+        slices = []
+        for domain in self._domains:
+            values = self._sorted[domain]
+            if not values or any(b[domain] is None for _, b in bounds):
+                continue
+            start, end = 0, len(values)
+            for op, b in bounds:
+                key = b[domain]
+                if op in ('>', '>=', '='):
+                    if op == '>':
+                        i = bisect_right(values, (key, self._last_id))
+                    else:
+                        i = bisect_left(values, (key,))
+                    start = max(start, i)
+                if op in ('<', '<=', '='):
+                    if op == '<':
+                        i = bisect_left(values, (key,))
+                    else:
+                        i = bisect_right(values, (key, self._last_id))
+                    end = min(end, i)
+            if start < end:
+                slices.append((values, start, end))
+        return slices
+
+    def count(self, conditions):
+        """Number of objects whose value satisfies every condition, or None
+        if the index can't answer exactly"""
+
+        slices = self._slices(conditions)
+        if slices is None:
+            return None
+        return sum(end - start for _, start, end in slices)
+
+    def search(self, conditions):
+        """IDs of the objects whose value satisfies every condition, or None
+        if the index can't answer exactly"""
+
+        slices = self._slices(conditions)
+        if slices is None:
+            return None
+        found = set()
+        for values, start, end in slices:
+            found.update(id for _, id in values[start:end])
+        return found
+
+    def dump(self):
+        entries = {}
+        for domain, values in self._sorted.items():
+            if domain in ('d', 'a'):
+                values = [[v.isoformat(), id] for v, id in values]
+            entries[domain] = values
+        return entries
+
+    def load(self, entries):
+        self.clear()
+        for domain, values in entries.items():
+            for value, id in values:
+                if domain in ('d', 'a'):
+                    value = datetime.fromisoformat(value)
+                self._sorted[domain].append((value, id))
+                self._keys[id] = (domain, value)
+        self._building = False
+        self.dirty = False
+
+
+class _ColumnIndex():
+    """Keeps the value of one attribute of one object type for every object,
+    so queries can read the attribute without opening the object files
+
+    :param obj_type: Cyber DEM type of the indexed objects
+    :param attr: name of the indexed attribute
+    """
+
+    kind = 'column'
+
+    def __init__(self, obj_type, attr):
+        self.obj_type = obj_type
+        self.attr = attr
+        self.key = (obj_type, attr, self.kind)
+        self.filename = f'{obj_type}.{attr}.{self.kind}.json'
+        self.dirty = False
+        self.clear()
+
+    def clear(self):
+        self._values = {}  # id -> value
+        self.dirty = True
+
+    def add(self, id, obj_dict):
+        """Indexes (or re-indexes) an object"""
+
+        value = obj_dict.get(self.attr)
+        if value is None:
+            self._values.pop(id, None)
+        else:
+            self._values[id] = value
+        self.dirty = True
+
+    def finish(self):
+        """Called after the index is filled by :meth:`add` from scratch"""
+
+        pass
+
+    def remove(self, id):
+        if self._values.pop(id, None) is not None:
+            self.dirty = True
+
+    def get(self, id):
+        return self._values.get(id)
+
+    def dump(self):
+        return self._values
+
+    def load(self, entries):
+        self._values = entries
+        self.dirty = False
+
+
+class _HistogramIndex():
+    """Counts the objects of one object type with each value of one
+    attribute, so the counts are read without opening the object files
+
+    An object whose value is a list is counted once for each of the
+    different values in it. The hash keys of each object's values are kept
+    too, so an object that is saved over is taken out of its old counts.
+
+    :param obj_type: Cyber DEM type of the indexed objects
+    :param attr: name of the indexed attribute
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, obj_type, attr):
+        self.obj_type = obj_type
+        self.attr = attr
+        self.key = (obj_type, attr, self.kind)
+        self.filename = f'{obj_type}.{attr}.{self.kind}.json'
+        self.dirty = False
+        self.clear()
+
+    def clear(self):
+        self._counts = {}  # hash key -> number of objects
+        self._keys = {}  # id -> tuple of hash keys
+        self.dirty = True
+
+    @staticmethod
+    def keys(value):
+        """The hash keys an attribute value is counted under"""
+
+        if value is None:
+            return ()
+        if value.__class__ is list:
+            return tuple(dict.fromkeys(
+                _hash_key(v) for v in value if v is not None))
+        return (_hash_key(value),)
+
+    def add(self, id, obj_dict):
+        """Indexes (or re-indexes) an object"""
+
+        self.remove(id)
+        keys = self.keys(obj_dict.get(self.attr))
+        if keys:
+            self._keys[id] = keys
+            for key in keys:
+                self._counts[key] = self._counts.get(key, 0) + 1
+        self.dirty = True
+
+    def finish(self):
+        """Called after the index is filled by :meth:`add` from scratch"""
+
+        pass
+
+    def remove(self, id):
+        keys = self._keys.pop(id, None)
+        if keys is not None:
+            for key in keys:
+                self._counts[key] -= 1
+                if not self._counts[key]:
+                    del self._counts[key]
+            self.dirty = True
+
+    def counts(self):
+        """The number of objects with each value, by hash key"""
+
+        return dict(self._counts)
+
+    def dump(self):
+        # each value is saved once, and the objects refer to it by number
+        numbers = {key: n for n, key in enumerate(self._counts)}
+        return {
+            'values': [list(key) for key in self._counts],
+            'ids': {
+                id: [numbers[key] for key in keys]
+                for id, keys in self._keys.items()}}
+
+    def load(self, entries):
+        self.clear()
+        values = [tuple(key) for key in entries['values']]
+        for id, numbers in entries['ids'].items():
+            keys = tuple(values[n] for n in numbers)
+            self._keys[id] = keys
+            for key in keys:
+                self._counts[key] = self._counts.get(key, 0) + 1
+        self.dirty = False
+
+
+class _AdjacencyIndex():
+    """Keeps the objects each Relationship connects as adjacency lists, so
+    the neighbors of an object are found without reading any files
+
+    Object IDs are numbered in the order they are first seen, and each
+    object's neighbors are kept as arrays of those numbers, one array per
+    relationship type, going out (the object is ``related_object_1``) and
+    coming in (it is ``related_object_2``). Only the objects at the ends of
+    Relationships are numbered; the edges are kept by Relationship ID.
+
+    :param obj_type: always ``'Relationship'``
+    :param attr: always ``'related_objects'``
+    """
+
+    kind = 'adjacency'
+    directions = ('out', 'in', 'both')
+
+    def __init__(self, obj_type, attr):
+        self.obj_type = obj_type
+        self.attr = attr
+        self.key = (obj_type, attr, self.kind)
+        self.filename = f'{obj_type}.{attr}.{self.kind}.json'
+        self.dirty = False
+        self.clear()
+
+    def clear(self):
+        self._ids = []  # number -> id
+        self._numbers = {}  # id -> number
+        self._out = {}  # number -> relationship_type -> array of numbers
+        self._in = {}
+        self._edges = {}  # relationship id -> (from, to, type)
+        self.dirty = True
+
+    def number(self, id):
+        """The number of an ID, numbering it if it is new"""
+
+        number = self._numbers.get(id)
+        if number is None:
+            number = self._numbers[id] = len(self._ids)
+            self._ids.append(id)
+        return number
+
+    def add(self, id, obj_dict):
+        """Indexes (or re-indexes) a Relationship"""
+
+        self.remove(id)
+        first = obj_dict.get('related_object_1')
+        second = obj_dict.get('related_object_2')
+        if first is None or second is None:
+            return
+        edge = (
+            self.number(first), self.number(second),
+            obj_dict.get('relationship_type'))
+        self._edges[id] = edge
+        self._out.setdefault(edge[0], {}).setdefault(
+            edge[2], array('l')).append(edge[1])
+        self._in.setdefault(edge[1], {}).setdefault(
+            edge[2], array('l')).append(edge[0])
+        self.dirty = True
+
+    def finish(self):
+        """Called after the index is filled by :meth:`add` from scratch"""
+
+        pass
+
+    def remove(self, id):
+        edge = self._edges.pop(id, None)
+        if edge is None:
+            return
+        self._out[edge[0]][edge[2]].remove(edge[1])
+        self._in[edge[1]][edge[2]].remove(edge[0])
+        self.dirty = True
+
+    def neighbors(self, id, relationship_type=None, direction='both'):
+        """IDs of the objects connected to an object, in O(degree)"""
+
+        number = self._numbers.get(id)
+        if number is None:
+            return []
+        lists = []
+        for adjacency in (
+                (self._out,) if direction == 'out' else
+                (self._in,) if direction == 'in' else (self._out, self._in)):
+            by_type = adjacency.get(number, {})
+            if relationship_type is None:
+                lists.extend(by_type.values())
+            elif relationship_type in by_type:
+                lists.append(by_type[relationship_type])
+        seen = set()
+        found = []
+        for numbers in lists:
+            for n in numbers:
+                if n not in seen:
+                    seen.add(n)
+                    found.append(self._ids[n])
+        return found
+
+    def dump(self):
+        return {
+            'ids': self._ids,
+            'edges': [[r, *edge] for r, edge in self._edges.items()]}
+
+    def load(self, entries):
+        self.clear()
+        if entries['edges'] and isinstance(entries['edges'][0][0], int):
+            # saved when Relationships were numbered like objects; number
+            # only the objects again
+            ids = entries['ids']
+            for r, first, second, relationship_type in entries['edges']:
+                self.add(ids[r], {
+                    'related_object_1': ids[first],
+                    'related_object_2': ids[second],
+                    'relationship_type': relationship_type})
+            return
+        self._ids = entries['ids']
+        self._numbers = {id: n for n, id in enumerate(self._ids)}
+        for r, first, second, relationship_type in entries['edges']:
+            edge = (first, second, relationship_type)
+            self._edges[r] = edge
+            self._out.setdefault(first, {}).setdefault(
+                relationship_type, array('l')).append(second)
+            self._in.setdefault(second, {}).setdefault(
+                relationship_type, array('l')).append(first)
+        self.dirty = False
+
+
+class _ComponentTracker():
+    """Union-find of the objects connected by Relationships, with the number
+    of objects of each type in each component
+
+    Objects have the numbers the adjacency index gives them. Union by size
+    and path halving make each lookup take amortized O(α(n)) time. Union-find
+    can't split components, so a Relationship that is saved with different
+    objects than before makes the tracker stale, and it is rebuilt from the
+    adjacency index when it is next used.
+
+    :param adjacency: :class:`_AdjacencyIndex` of the Relationships
+    :param object_types: the FileSystem's dict of ID -> Cyber DEM type
+    """
+
+    def __init__(self, adjacency, object_types):
+        self._adjacency = adjacency
+        self._object_types = object_types
+        self.build()
+
+    def build(self):
+        """Finds the components of every Relationship in the index"""
+
+        self._parent = array('l')
+        self._size = array('l')  # objects in each component, by root
+        self._types = {}  # object -> type, for objects in a Relationship
+        self._counts = {}  # root -> type -> number of objects
+        self._edges = {}  # relationship -> (object, object)
+        self.stale = False
+        for relationship, edge in list(self._adjacency._edges.items()):
+            self._connect(relationship, edge[0], edge[1])
+
+    def _grow(self):
+        for number in range(len(self._parent), len(self._adjacency._ids)):
+            self._parent.append(number)
+            self._size.append(0)
+
+    def find(self, number):
+        parent = self._parent
+        while parent[number] != number:
+            parent[number] = parent[parent[number]]
+            number = parent[number]
+        return number
+
+    def _add(self, number):
+        """Counts an object in its component, the first time it is in a
+        Relationship"""
+
+        if number in self._types:
+            return
+        obj_type = self._object_types.get(self._adjacency._ids[number])
+        self._types[number] = obj_type
+        root = self.find(number)
+        self._size[root] += 1
+        counts = self._counts.setdefault(root, {})
+        counts[obj_type] = counts.get(obj_type, 0) + 1
+
+    def _connect(self, relationship, first, second):
+        self._grow()
+        self._edges[relationship] = (first, second)
+        self._add(first)
+        self._add(second)
+        a, b = self.find(first), self.find(second)
+        if a == b:
+            return
+        if self._size[a] < self._size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] += self._size[b]
+        # merge the smaller component's counts into the larger's
+        counts = self._counts.pop(b, {})
+        into = self._counts.setdefault(a, {})
+        for obj_type, n in counts.items():
+            into[obj_type] = into.get(obj_type, 0) + n
+
+    def record(self, obj_type, id):
+        """Updates the components for an object that was just saved (after
+        the adjacency index was updated)"""
+
+        if self.stale:
+            return
+        number = self._adjacency._numbers.get(id)
+        # an object that was only known from Relationships
+        if number in self._types and self._types[number] != obj_type:
+            counts = self._counts[self.find(number)]
+            counts[self._types[number]] -= 1
+            if not counts[self._types[number]]:
+                del counts[self._types[number]]
+            counts[obj_type] = counts.get(obj_type, 0) + 1
+            self._types[number] = obj_type
+        if obj_type != 'Relationship':
+            return
+        edge = self._adjacency._edges.get(id)
+        previous = self._edges.get(id)
+        if previous is not None and (edge is None or edge[:2] != previous):
+            self.stale = True
+        elif edge is not None:
+            self._connect(id, edge[0], edge[1])
+
+    def summary(self, id, obj_type=None):
+        number = self._adjacency._numbers.get(id)
+        if number is None or number not in self._types:
+            return {'id': id, 'size': 1, 'types': {obj_type: 1}}
+        root = self.find(number)
+        return {
+            'id': self._adjacency._ids[root], 'size': self._size[root],
+            'types': dict(self._counts[root])}
+
+    def summaries(self, min_size=2):
+        return [
+            {'id': self._adjacency._ids[root], 'size': self._size[root],
+             'types': dict(counts)}
+            for root, counts in sorted(
+                self._counts.items(), key=lambda rc: -self._size[rc[0]])
+            if self._size[root] >= min_size]
+
+
+_INDEX_KINDS = {
+    _HashIndex.kind: _HashIndex,
+    _RangeIndex.kind: _RangeIndex,
+    _ColumnIndex.kind: _ColumnIndex,
+    _HistogramIndex.kind: _HistogramIndex,
+    _AdjacencyIndex.kind: _AdjacencyIndex}
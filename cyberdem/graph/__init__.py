@@ -0,0 +1,851 @@
+"""
+Cyber DEM Graph Module
+
+Cyber DEM Python
+
+Copyright 2020 Carnegie Mellon University.
+
+NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING INSTITUTE
+MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON UNIVERSITY MAKES NO
+WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS TO ANY MATTER
+INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE OR
+MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE MATERIAL.
+CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND WITH RESPECT
+TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+
+Released under a MIT (SEI)-style license, please see license.txt or contact
+permission@sei.cmu.edu for full terms.
+
+[DISTRIBUTION STATEMENT A] This material has been approved for public release
+and unlimited distribution.  Please see Copyright notice for non-US Government
+use and distribution.
+
+DM20-0711
+"""
+
+from array import array
+from collections import deque
+import json
+import mmap
+import struct
+import sys
+
+try:
+    import numpy
+except ImportError:  # numpy is optional (pip install cyberdem[graph])
+    numpy = None
+
+
+class Graph():
+    """Reachability over the Relationships in a FileSystem
+
+    The Relationships are read from the FileSystem's adjacency index (see
+    :meth:`~cyberdem.filesystem.FileSystem.neighbors`) into a compressed
+    sparse row (CSR) graph: the objects are numbered, and the neighbors of
+    object ``n`` are ``targets[offsets[n]:offsets[n+1]]``. If numpy is
+    installed, the arrays are numpy arrays and each step of a breadth first
+    search is done for the whole frontier at once; otherwise the same
+    searches run in pure Python. The graph is a snapshot; make a new one to
+    see Relationships saved after it was made.
+
+    :param filesystem: where the Relationships are stored
+    :type filesystem: :class:`~cyberdem.filesystem.FileSystem`, required
+    :param relationship_types: only follow Relationships of these types; put
+        None in the list to follow Relationships that don't have a type
+    :type relationship_types: list of strings, optional (default is every
+        type)
+    :param direction: 'out' to go from ``related_object_1`` to
+        ``related_object_2``, 'in' to go the other way, or 'both'
+    :type direction: string, optional (default='both')
+
+    :Example:
+        >>> from cyberdem.graph import Graph
+        >>> graph = Graph(fs, relationship_types=['ResidesOn', None])
+        >>> graph.k_hop(my_device.id, 2)
+        {'0b7d2a4e-63b5-4d0f-a2a6-2be1c5c1f3a4', ...}
+        >>> graph.shortest_path(my_device.id, other_device.id)
+        ['a1c1...', '23f5...', '9b0e...']
+    """
+
+    directions = ('out', 'in', 'both')
+
+    def __init__(self, filesystem, relationship_types=None, direction='both'):
+        if direction not in self.directions:
+            raise ValueError(
+                f'{direction} is not an acceptable value for direction. '
+                f'Choose from {", ".join(self.directions)}')
+        self.direction = direction
+
+        adjacency = filesystem._adjacency()
+        self.ids = list(adjacency._ids)  # number -> id
+        self.numbers = {id: n for n, id in enumerate(self.ids)}
+        self.types = []  # relationship type code -> relationship type
+        codes = {}
+        sources, targets, type_codes = array('l'), array('l'), array('l')
+        for first, second, relationship_type in adjacency._edges.values():
+            if relationship_types is not None and \
+                    relationship_type not in relationship_types:
+                continue
+            code = codes.get(relationship_type)
+            if code is None:
+                code = codes[relationship_type] = len(self.types)
+                self.types.append(relationship_type)
+            if direction != 'in':
+                sources.append(first)
+                targets.append(second)
+                type_codes.append(code)
+            if direction != 'out':
+                sources.append(second)
+                targets.append(first)
+                type_codes.append(code)
+        self._csr(sources, targets, type_codes)
+        self._by_target = None
+
+    def _csr(self, sources, targets, type_codes):
+        """Sorts the edges by source into offsets, targets, and type_codes"""
+
+        n = len(self.ids)
+        if numpy is not None:
+            sources = numpy.asarray(sources, dtype=numpy.int64)
+            order = numpy.argsort(sources, kind='stable')
+            self.targets = numpy.asarray(targets, dtype=numpy.int64)[order]
+            self.type_codes = numpy.asarray(
+                type_codes, dtype=numpy.int64)[order]
+            self.offsets = numpy.zeros(n + 1, dtype=numpy.int64)
+            numpy.cumsum(
+                numpy.bincount(sources, minlength=n), out=self.offsets[1:])
+            return
+
+        # counting sort
+        self.offsets = array('l', [0] * (n + 1))
+        for source in sources:
+            self.offsets[source + 1] += 1
+        for i in range(n):
+            self.offsets[i + 1] += self.offsets[i]
+        position = array('l', self.offsets)
+        self.targets = array('l', [0] * len(targets))
+        self.type_codes = array('l', [0] * len(targets))
+        for source, target, code in zip(sources, targets, type_codes):
+            self.targets[position[source]] = target
+            self.type_codes[position[source]] = code
+            position[source] += 1
+
+    def __len__(self):
+        """Number of edges"""
+
+        return len(self.targets)
+
+    def save(self, path):
+        """Saves the graph to a binary file that :meth:`load` can map into
+        memory
+
+        After a short header, the file holds the CSR arrays (``offsets``,
+        ``targets``, and ``type_codes``) as little-endian 64-bit integers,
+        followed by the IDs of the objects as utf-8 text with their offsets
+        and their order when sorted, so other tools can read the graph
+        without parsing any json.
+
+        :param path: where to save the file
+        :type path: string, required
+        """
+
+        ids = [id.encode('utf-8') for id in self.ids]
+        id_offsets = array('q', [0])
+        for id in ids:
+            id_offsets.append(id_offsets[-1] + len(id))
+        header = json.dumps({
+            'version': _FORMAT_VERSION, 'direction': self.direction,
+            'types': self.types, 'ids': len(ids), 'edges': len(self),
+            'id_bytes': id_offsets[-1]}).encode('utf-8')
+        header += b' ' * (-len(header) % 8)
+
+        with open(path, 'wb') as f:
+            f.write(_MAGIC + struct.pack('<Q', len(header)) + header)
+            for values in (self.offsets, self.targets, self.type_codes,
+                           id_offsets,
+                           sorted(range(len(ids)), key=ids.__getitem__)):
+                _write_int64(f, values)
+            f.write(b''.join(ids))
+        f.close()
+
+    @classmethod
+    def load(cls, path):
+        """Opens a graph saved by :meth:`save` (or
+        :meth:`~cyberdem.filesystem.FileSystem.export_graph`)
+
+        The file is mapped into memory rather than read, and the arrays are
+        used where they are in the mapping (as numpy arrays, or memoryviews
+        without numpy), so opening a graph takes about the same time however
+        big it is. IDs are decoded when they are used and looked up by a
+        binary search of their sorted order.
+
+        :param path: the file to open
+        :type path: string, required
+        :rtype: :class:`Graph`
+
+        :Example:
+            >>> fs.export_graph('network.graph')
+            >>> graph = Graph.load('network.graph')
+            >>> graph.k_hop(my_device.id, 2)
+            {'0b7d2a4e-63b5-4d0f-a2a6-2be1c5c1f3a4', ...}
+        """
+
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        if buffer[:len(_MAGIC)] != _MAGIC:
+            raise Exception(f'{path} is not a Cyber DEM graph file')
+        start = len(_MAGIC) + 8
+        length, = struct.unpack_from('<Q', buffer, len(_MAGIC))
+        header = json.loads(bytes(buffer[start:start + length]))
+        if header['version'] != _FORMAT_VERSION:
+            raise Exception(
+                f'{path} is version {header["version"]} of the graph file '
+                f'format; only version {_FORMAT_VERSION} can be read')
+        start += length
+
+        def section(count, vector=True):
+            nonlocal start
+            values = _read_int64(buffer, start, count, vector)
+            start += 8 * count
+            return values
+
+        graph = cls.__new__(cls)
+        graph.direction = header['direction']
+        graph.types = header['types']
+        n, m = header['ids'], header['edges']
+        graph.offsets = section(n + 1)
+        graph.targets = section(m)
+        graph.type_codes = section(m)
+        id_offsets = section(n + 1, vector=False)
+        id_order = section(n, vector=False)
+        graph.ids = _Ids(
+            id_offsets, id_order,
+            memoryview(buffer)[start:start + header['id_bytes']])
+        graph.numbers = _Numbers(graph.ids)
+        graph._by_target = None
+        return graph
+
+    def _neighbors(self, number):
+        return self.targets[self.offsets[number]:self.offsets[number + 1]]
+
+    def _expand(self, frontier):
+        """All the neighbors of a numpy array of objects, and the object each
+        one is a neighbor of"""
+
+        starts = self.offsets[frontier]
+        lengths = self.offsets[frontier + 1] - starts
+        # the positions in targets of each object's neighbors, one after
+        # another: start + 0, 1, ... for each object
+        ends = numpy.cumsum(lengths)
+        positions = numpy.arange(ends[-1] if len(ends) else 0) + \
+            numpy.repeat(starts - (ends - lengths), lengths)
+        return self.targets[positions], numpy.repeat(frontier, lengths)
+
+    def _search(self, sources, max_hops=None, target=None):
+        """Breadth first search from the given object numbers
+
+        :return: (objects in the order they were reached, their distances,
+            and the object each was reached from, or -1 for the sources)
+        """
+
+        if numpy is not None:
+            n = len(self.ids)
+            distance = numpy.full(n, -1, dtype=numpy.int64)
+            parent = numpy.full(n, -1, dtype=numpy.int64)
+            frontier = numpy.unique(numpy.array(sources, dtype=numpy.int64))
+            distance[frontier] = 0
+            order = [frontier]
+            hops = 0
+            while len(frontier) and (max_hops is None or hops < max_hops):
+                if target is not None and distance[target] >= 0:
+                    break
+                reached, came_from = self._expand(frontier)
+                new = distance[reached] < 0
+                frontier, first = numpy.unique(
+                    reached[new], return_index=True)
+                hops += 1
+                distance[frontier] = hops
+                parent[frontier] = came_from[new][first]
+                order.append(frontier)
+            order = numpy.concatenate(order)
+            return order.tolist(), distance[order].tolist(), parent
+
+        distance = {}
+        parent = {}
+        queue = deque()
+        for source in sources:
+            if source not in distance:
+                distance[source] = 0
+                parent[source] = -1
+                queue.append(source)
+        while queue:
+            number = queue.popleft()
+            if number == target:
+                break
+            hops = distance[number]
+            if max_hops is not None and hops >= max_hops:
+                continue
+            for neighbor in self._neighbors(number):
+                if neighbor not in distance:
+                    distance[neighbor] = hops + 1
+                    parent[neighbor] = number
+                    queue.append(neighbor)
+        return list(distance), list(distance.values()), parent
+
+    def _numbers(self, ids):
+        """Numbers of a list of IDs (or one ID), with objects that aren't in
+        any Relationship numbered after the rest"""
+
+        if isinstance(ids, str):
+            ids = [ids]
+        numbers = []
+        for id in ids:
+            number = self.numbers.get(id)
+            if number is None:
+                # an object with no Relationships; it can only reach itself
+                number = self.numbers[id] = len(self.ids)
+                self.ids.append(id)
+                self._grow()
+            numbers.append(number)
+        return numbers
+
+    def _grow(self):
+        """Adds an object with no edges to the end of the offsets"""
+
+        if numpy is not None:
+            self.offsets = numpy.append(self.offsets, self.offsets[-1])
+        else:
+            if not isinstance(self.offsets, array):
+                # a memoryview of a graph file
+                self.offsets = array('q', self.offsets)
+            self.offsets.append(self.offsets[-1])
+        self._by_target = None
+
+    def bfs(self, sources, max_hops=None):
+        """Breadth first search from one or more objects
+
+        :param sources: ID(s) of the objects to start from
+        :type sources: string or list of strings, required
+        :param max_hops: stop after this many Relationships
+        :type max_hops: int, optional (default is no limit)
+
+        :return: the ID of every object reached, and the number of
+            Relationships followed to reach it, in the order they were reached
+        :rtype: dict
+        """
+
+        order, distances, _ = self._search(self._numbers(sources), max_hops)
+        return {self.ids[n]: d for n, d in zip(order, distances)}
+
+    def reachable(self, sources, max_hops=None):
+        """IDs of the objects that can be reached from one or more objects
+        (including the objects themselves)
+
+        :param sources: ID(s) of the objects to start from
+        :type sources: string or list of strings, required
+        :param max_hops: only follow this many Relationships
+        :type max_hops: int, optional (default is no limit)
+        :rtype: set of strings
+        """
+
+        return set(self.bfs(sources, max_hops))
+
+    def k_hop(self, sources, k):
+        """IDs of the objects within k Relationships of one or more objects,
+        not counting the objects themselves
+
+        :param sources: ID(s) of the objects to start from
+        :type sources: string or list of strings, required
+        :param k: number of Relationships to follow
+        :type k: int, required
+        :rtype: set of strings
+        """
+
+        return {id for id, d in self.bfs(sources, k).items() if d > 0}
+
+    def shortest_path(self, source, target, max_hops=None):
+        """One of the shortest paths between two objects
+
+        :param source: ID of the object to start from
+        :type source: string, required
+        :param target: ID of the object to reach
+        :type target: string, required
+        :param max_hops: longest path to look for
+        :type max_hops: int, optional (default is no limit)
+
+        :return: IDs of the objects on the path, from source to target, or
+            None if the target can't be reached
+        :rtype: list of strings or None
+        """
+
+        start, end = self._numbers([source, target])
+        order, _, parent = self._search([start], max_hops, end)
+        if end not in order:
+            return None
+        path = [end]
+        while path[-1] != start:
+            path.append(int(parent[path[-1]]))
+        return [self.ids[n] for n in reversed(path)]
+
+    def all_simple_paths(
+            self, source, target, max_length=None, max_paths=1000):
+        """Paths between two objects that don't visit any object twice
+
+        The number of simple paths can grow exponentially with the size of
+        the graph, so the search stops once ``max_paths`` are found.
+
+        :param source: ID of the object to start from
+        :type source: string, required
+        :param target: ID of the object to reach
+        :type target: string, required
+        :param max_length: longest path to look for, in Relationships
+        :type max_length: int, optional (default is no limit)
+        :param max_paths: most paths to return
+        :type max_paths: int, optional (default=1000)
+
+        :return: paths, each a list of IDs from source to target
+        :rtype: list of lists of strings
+        """
+
+        start, end = self._numbers([source, target])
+        if start == end:
+            return [[source]]
+        if max_length is None:
+            max_length = len(self.ids)
+        paths = []
+        path = [start]
+        on_path = {start}
+        # a stack of iterators over the neighbors of each object on the path
+        stack = [iter(self._neighbors(start).tolist())
+                 if numpy is not None else iter(self._neighbors(start))]
+        while stack and len(paths) < max_paths:
+            neighbor = next(stack[-1], None)
+            if neighbor is None:
+                stack.pop()
+                on_path.discard(path.pop())
+                continue
+            if neighbor in on_path:
+                continue
+            if neighbor == end:
+                paths.append([self.ids[n] for n in path + [end]])
+            elif len(path) < max_length:
+                path.append(neighbor)
+                on_path.add(neighbor)
+                neighbors = self._neighbors(neighbor)
+                stack.append(iter(
+                    neighbors.tolist() if numpy is not None else neighbors))
+        return paths
+
+    def reach_counts(self, sources=None, max_hops=None):
+        """The number of other objects each object can reach
+
+        With numpy, 64 searches are run at once with one bit for each in a
+        64-bit integer per object, so a sweep over every object takes
+        ``max_hops`` (or the graph's diameter) passes over the edges for each
+        64 sources. If Relationships are followed in both directions and
+        there is no ``max_hops``, the counts come from the sizes of the
+        connected components instead.
+
+        :param sources: IDs of the objects to count from
+        :type sources: list of strings, optional (default is every object
+            with a Relationship)
+        :param max_hops: only follow this many Relationships
+        :type max_hops: int, optional (default is no limit)
+        :rtype: dict of ID -> int
+        """
+
+        if sources is None:
+            # objects with an edge going out, or coming in (ex. sinks like
+            # Data when only outgoing Relationships are followed)
+            if numpy is not None:
+                linked = numpy.diff(self.offsets) > 0
+                linked[numpy.asarray(self.targets, dtype=numpy.int64)] = True
+                numbers = numpy.flatnonzero(linked).tolist()
+            else:
+                targets = set(self.targets)
+                numbers = [
+                    n for n in range(len(self.ids))
+                    if self.offsets[n + 1] > self.offsets[n] or n in targets]
+        else:
+            numbers = self._numbers(sources)
+
+        if self.direction == 'both' and max_hops is None:
+            labels = self.components()
+            sizes = {}
+            for label in labels:
+                sizes[label] = sizes.get(label, 0) + 1
+            return {
+                self.ids[n]: sizes[labels[n]] - 1 for n in numbers}
+
+        if numpy is None:
+            return {
+                self.ids[n]: len(self._search([n], max_hops)[0]) - 1
+                for n in numbers}
+
+        counts = {}
+        for i in range(0, len(numbers), 64):
+            batch = numbers[i:i + 64]
+            for n, count in zip(batch, self._bit_search(batch, max_hops)):
+                counts[self.ids[n]] = int(count) - 1
+        return counts
+
+    def _bit_search(self, batch, max_hops):
+        """Breadth first searches from up to 64 objects at once
+
+        :return: numpy array of the number of objects each search reached
+        """
+
+        if self._by_target is None:
+            # the edges grouped by target, to OR together the bits of the
+            # objects that reach each target in one reduceat
+            sources = numpy.repeat(
+                numpy.arange(len(self.ids)), numpy.diff(self.offsets))
+            order = numpy.argsort(self.targets, kind='stable')
+            targets = self.targets[order]
+            starts = numpy.flatnonzero(
+                numpy.r_[True, targets[1:] != targets[:-1]]) \
+                if len(targets) else numpy.zeros(0, dtype=numpy.int64)
+            self._by_target = (sources[order], targets[starts], starts)
+        sources, targets, starts = self._by_target
+
+        visited = numpy.zeros(len(self.ids), dtype=numpy.uint64)
+        for bit, n in enumerate(batch):
+            visited[n] |= numpy.uint64(1) << numpy.uint64(bit)
+        frontier = visited.copy()
+        hops = 0
+        while len(starts) and (max_hops is None or hops < max_hops):
+            reached = numpy.bitwise_or.reduceat(frontier[sources], starts)
+            new = reached & ~visited[targets]
+            if not new.any():
+                break
+            frontier = numpy.zeros_like(visited)
+            frontier[targets] = new
+            visited[targets] |= new
+            hops += 1
+
+        # count the objects with each bit set
+        visited = visited[visited != 0].astype('<u8')
+        bits = numpy.unpackbits(
+            visited.view(numpy.uint8).reshape(-1, 8), axis=1,
+            bitorder='little')
+        return bits.sum(axis=0, dtype=numpy.int64)[:len(batch)]
+
+    def components(self):
+        """Labels each object with the connected component it is in,
+        ignoring the direction of the Relationships
+
+        The objects are the ones at the ends of Relationships; the
+        Relationships themselves are edges, not objects in a component.
+
+        :return: the label of each object, by number; two objects are in the
+            same component if they have the same label
+        :rtype: list of ints
+        """
+
+        n = len(self.ids)
+        if numpy is not None:
+            # hook each edge's larger label to its smaller one, then
+            # shortcut the labels, until nothing changes
+            sources = numpy.repeat(numpy.arange(n), numpy.diff(self.offsets))
+            labels = numpy.arange(n)
+            while True:
+                low = numpy.minimum(labels[sources], labels[self.targets])
+                previous = labels.copy()
+                numpy.minimum.at(labels, labels[sources], low)
+                numpy.minimum.at(labels, labels[self.targets], low)
+                while True:
+                    jumped = labels[labels]
+                    if (jumped == labels).all():
+                        break
+                    labels = jumped
+                if (labels == previous).all():
+                    return labels.tolist()
+
+        # union-find, labelling each component with its smallest number
+        labels = list(range(n))
+
+        def find(number):
+            while labels[number] != number:
+                labels[number] = labels[labels[number]]
+                number = labels[number]
+            return number
+
+        for number in range(n):
+            for neighbor in self._neighbors(number):
+                a, b = find(number), find(neighbor)
+                if a != b:
+                    labels[max(a, b)] = min(a, b)
+        return [find(number) for number in range(n)]
+
+
+# the Relationships an object depends on the other object through, and the
+# direction to follow from an object to the objects that depend on it
+DEPENDENCIES = {
+    'ResidesOn': 'in', 'HasResident': 'out',
+    'ComponentOf': 'in', 'HasComponent': 'out',
+    'ContainedIn': 'in', 'Contains': 'out',
+    'ProvidedBy': 'in', 'Provides': 'out',
+}
+
+
+def blast_radius(filesystem, events, dependencies=None):
+    """The objects that depend on the targets of CyberEvents
+
+    An object depends on another if it is related to it by one of the
+    ``dependencies`` (ex. an OperatingSystem that ResidesOn a Device), or
+    depends on an object that does, so a Deny of a Device reaches the
+    OperatingSystems on it, the Services on those, and the Data on those.
+
+    Every event is answered from one search of the Relationships (the
+    adjacency index, see :meth:`~cyberdem.filesystem.FileSystem.neighbors`)
+    from all of their targets. The search finds the strongly connected
+    components of the objects reached, and the dependents of each component
+    are worked out once, from the components that depend on it, so objects
+    shared by the targets of several events are only visited once.
+
+    :param filesystem: where the Relationships are stored
+    :type filesystem: :class:`~cyberdem.filesystem.FileSystem`, required
+    :param events: CyberEvents with ``target_ids`` (ex. Deny, Degrade, or
+        Destroy)
+    :type events: list of CyberEvents, required
+    :param dependencies: relationship type -> 'in' to go from
+        ``related_object_2`` to the ``related_object_1`` that depends on it,
+        'out' to go the other way, or 'both'; use None as a type for
+        Relationships without one (ex. ``{None: 'in'}`` adds the Devices
+        connected to a NetworkLink)
+    :type dependencies: dict, optional (default is :data:`DEPENDENCIES`)
+
+    :return: event ID -> IDs of the objects that depend on the event's
+        targets, not including the targets themselves
+    :rtype: dict of string -> set of strings
+
+    :Example:
+        >>> from cyberdem.graph import blast_radius
+        >>> deny = Deny(target_ids=[my_device.id])
+        >>> blast_radius(fs, [deny])
+        {'5d6a...': {'0b7d...', '23f5...'}}
+    """
+
+    if dependencies is None:
+        dependencies = DEPENDENCIES
+    for relationship_type, direction in dependencies.items():
+        if direction not in Graph.directions:
+            raise ValueError(
+                f'{direction} is not an acceptable value for the direction '
+                f'of {relationship_type}. Choose from '
+                f'{", ".join(Graph.directions)}')
+    adjacency = filesystem._adjacency()
+    follow = [
+        (adjacency._out, t) for t, d in dependencies.items() if d != 'in'] + [
+        (adjacency._in, t) for t, d in dependencies.items() if d != 'out']
+
+    def dependents(number):
+        for lists, relationship_type in follow:
+            yield from lists.get(number, {}).get(relationship_type, ())
+
+    targets = {}  # event ID -> numbers of its targets
+    for event in events:
+        ids = getattr(event, 'target_ids', None) or []
+        targets[event.id] = {
+            adjacency._numbers[id] for id in ids if id in adjacency._numbers}
+    components, members, successors = _condense(
+        set().union(*targets.values()), dependents)
+
+    # the dependents of each component, from those of its successors (which
+    # come before it); a set is kept until every component (and event) that
+    # needs it has used it, and the last one to need it takes it over
+    # instead of copying it
+    uses = [0] * len(members)
+    for after in successors:
+        for successor in after:
+            uses[successor] += 1
+    for numbers in targets.values():
+        for number in numbers:
+            uses[components[number]] += 1
+    reached = [None] * len(members)
+    for component, after in enumerate(successors):
+        largest = max(after, key=lambda c: len(reached[c]), default=None)
+        if largest is not None and uses[largest] == 1:
+            found = reached[largest]
+        else:
+            found = set() if largest is None else set(reached[largest])
+        for successor in after:
+            if successor != largest:
+                found.update(reached[successor])
+            uses[successor] -= 1
+            if not uses[successor]:
+                reached[successor] = None
+        found.update(members[component])
+        reached[component] = found
+
+    radius = {}
+    for event_id, numbers in targets.items():
+        found = set()
+        for number in numbers:
+            found.update(reached[components[number]])
+        radius[event_id] = {
+            adjacency._ids[n] for n in found if n not in numbers}
+    return radius
+
+
+def _condense(sources, successors):
+    """Strongly connected components of the objects reachable from sources
+    (Tarjan's algorithm, without recursion)
+
+    :return: (object -> component, objects in each component, and the
+        components each component has edges to); components are numbered
+        so that every edge goes to a component with a smaller number
+    """
+
+    index = {}  # object -> order it was found in
+    low = {}  # object -> lowest index it can reach on the stack
+    stack = []
+    components = {}
+    members = []
+    after = []
+    for source in sources:
+        if source in index:
+            continue
+        index[source] = low[source] = len(index)
+        stack.append(source)
+        work = [(source, successors(source))]
+        while work:
+            number, neighbors = work[-1]
+            for neighbor in neighbors:
+                if neighbor not in index:
+                    index[neighbor] = low[neighbor] = len(index)
+                    stack.append(neighbor)
+                    work.append((neighbor, successors(neighbor)))
+                    break
+                if neighbor not in components:  # still on the stack
+                    low[number] = min(low[number], index[neighbor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[number])
+                if low[number] == index[number]:
+                    component = len(members)
+                    found = []
+                    while True:
+                        member = stack.pop()
+                        components[member] = component
+                        found.append(member)
+                        if member == number:
+                            break
+                    members.append(found)
+
+    # edges between components, found once every component is known
+    for found in members:
+        after.append({
+            components[neighbor]
+            for member in found for neighbor in successors(member)
+            if components[neighbor] != components[found[0]]})
+    return components, members, after
+
+
+# first bytes of a graph file, and the version of its layout
+_MAGIC = b'CYBERDEM GRAPH\r\n'  # 16 bytes, so the arrays are aligned
+_FORMAT_VERSION = 1
+
+
+def _write_int64(f, values):
+    """Writes integers to a file as little-endian 64-bit integers"""
+
+    if numpy is not None:
+        f.write(numpy.asarray(values, dtype='<i8').tobytes())
+        return
+    values = array('q', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    values.tofile(f)
+
+
+def _read_int64(buffer, start, count, vector=True):
+    """Little-endian 64-bit integers in a buffer, without copying them
+
+    :return: a numpy array if numpy is installed and ``vector`` is True,
+        otherwise a memoryview (or an array on big-endian machines)
+    """
+
+    if vector and numpy is not None:
+        return numpy.frombuffer(buffer, dtype='<i8', count=count, offset=start)
+    view = memoryview(buffer)[start:start + 8 * count]
+    if sys.byteorder == 'little':
+        return view.cast('q')
+    values = array('q')
+    values.frombytes(view)
+    values.byteswap()
+    return values
+
+
+class _Ids():
+    """The IDs of the objects in a graph file, decoded as they are used"""
+
+    def __init__(self, offsets, order, text):
+        self._offsets = offsets
+        self._order = order  # numbers of the IDs, sorted by ID
+        self._text = text
+        self._added = []  # IDs of objects added after the graph was loaded
+
+    def __len__(self):
+        return len(self._order) + len(self._added)
+
+    def __getitem__(self, number):
+        if number >= len(self._order):
+            return self._added[number - len(self._order)]
+        return self._encoded(number).decode('utf-8')
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self[number]
+
+    def _encoded(self, number):
+        return bytes(
+            self._text[self._offsets[number]:self._offsets[number + 1]])
+
+    def append(self, id):
+        self._added.append(id)
+
+    def number(self, id):
+        """Number of an ID in the file, or None"""
+
+        id = id.encode('utf-8')
+        low, high = 0, len(self._order)
+        while low < high:
+            middle = (low + high) // 2
+            if self._encoded(self._order[middle]) < id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self._order) and \
+                self._encoded(self._order[low]) == id:
+            return self._order[low]
+        return None
+
+
+class _Numbers():
+    """Number of each ID of a graph file, looked up like a dict"""
+
+    def __init__(self, ids):
+        self._ids = ids
+        self._added = {}
+
+    def get(self, id, default=None):
+        number = self._added.get(id)
+        if number is None:
+            number = self._ids.number(id)
+        return default if number is None else number
+
+    def __contains__(self, id):
+        return self.get(id) is not None
+
+    def __getitem__(self, id):
+        number = self.get(id)
+        if number is None:
+            raise KeyError(id)
+        return number
+
+    def __setitem__(self, id, number):
+        self._added[id] = number
@@ -24,16 +24,48 @@ DM20-0711
 """
 
 from cyberdem.base import *
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from functools import partial
+from hashlib import blake2b
+from math import ceil
 import ipaddress
+import json
+import os
 import random
+import socket
+import uuid
+
+try:
+    import numpy
+except ImportError:  # numpy is optional (pip install cyberdem[graph])
+    numpy = None
 
 def generate_network(
         num_devices, num_users, filesystem, purpose='enterprise',
-        heterogeneity=0, network='192.168.0.0/16'):
+        heterogeneity=0, network='192.168.0.0/16', seed=None, workers=None,
+        virtual=False, software=True, data=True):
     """Create a network of a given size and purpose.
 
     Given basic parameters, create cyber Objects such as devices, network
-    links, software, accounts, and their relationships to each other.
+    links, software, data, accounts, and their relationships to each other.
+    The Applications, Services, and Data that reside on each device are
+    copied from template objects for its type of device, with more kinds of
+    them the higher the ``heterogeneity``.
+
+    The network is made in shards of up to 10,000 objects, each with its own
+    random number generator seeded from ``seed``, so the same seed always
+    makes the same network (including the objects' IDs), however many
+    ``workers`` make it.
+
+    A ``virtual`` network is not made at all: only the parameters and the
+    seed are saved, and each object is made from them when
+    :meth:`~cyberdem.filesystem.FileSystem.get` or
+    :meth:`~cyberdem.filesystem.FileSystem.query` needs it. Its IDs encode
+    what kind of object each is and its number, so ``get`` makes just that
+    object. Virtual objects can be saved over like others, but they aren't
+    in the FileSystem's indexes (so :meth:`neighbors`, components, and
+    graphs of the FileSystem don't include them) or its flat file.
 
     :param num_devices: total number of workstations, routers, printers, etc.
     :type num_devices: int, required
@@ -54,12 +86,28 @@ def generate_network(
     :type heterogeneity: int, optional (default=0) chose from 0-5
     :param network: the network address range to use
     :type network: string, optional (default 192.168.0.0/16)
+    :param seed: seed for the random choices and IDs
+    :type seed: int or string, optional (default is a different network
+        each time)
+    :param workers: number of processes to make the shards in
+    :type workers: int, optional (default is to use only this process)
+    :param virtual: save only the parameters and seed, and make the objects
+        when they are used
+    :type virtual: bool, optional (default=False)
+    :param software: put Applications and Services on the devices
+    :type software: bool, optional (default=True)
+    :param data: put Data on the devices
+    :type data: bool, optional (default=True)
 
     :Example:
         >>> from cyberdem.widgets import generate_network
         >>> from cyberdem.filesystem import FileSystem
         >>> fs = FileSystem('./test-fs')
         >>> generate_network(10, 10, fs)
+        >>> generate_network(1000000, 5000, big_fs, network='10.0.0.0/8',
+        ...                  seed=42, workers=8)
+        >>> generate_network(5000000, 20000, what_if_fs,
+        ...                  network='10.0.0.0/8', virtual=True)
     """
 
     purposes = ['enterprise', 'scada', 'backbone']
@@ -83,6 +131,76 @@ def generate_network(
     if heterogeneity not in range(0,6):
         raise ValueError(
             f"heterogeneity: {heterogeneity} must be an integer 0-5")
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        raise ValueError(f'workers: {workers} must be a positive integer')
+
+    if virtual:
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        filesystem._add_virtual(_VirtualNetwork(
+            num_devices, num_users, purpose, heterogeneity, network, seed,
+            software, data))
+        return
+
+    plan, rng = _plan_network(
+        num_devices, num_users, purpose, heterogeneity, network, seed,
+        software, data)
+    subnets = plan.subnets
+    oses = plan.oses
+
+    # Split the devices, NetworkLinks (one per subnet), and users into
+    # shards. Each shard gets the next seed from rng, so it makes the same
+    # objects whichever process makes it.
+    shards = []
+    for kind, total in (
+            ('devices', num_devices), ('links', len(subnets)),
+            ('users', num_users)):
+        for start in range(0, total, _SHARD_SIZE):
+            shards.append((
+                kind, start, min(start + _SHARD_SIZE, total),
+                rng.getrandbits(64)))
+
+    for folder in [
+            'Device', 'NetworkLink', 'OperatingSystem', 'Persona',
+            'Relationship'] + plan.inventory_types():
+        if folder not in filesystem._folders:
+            filesystem._create_folder(folder)
+    indexed = {obj_type for obj_type, _, _ in filesystem._indexes}
+    used = set()
+
+    # the shards' files are written by the workers, and then added to the
+    # FileSystem's journal and indexes in order
+    if workers is not None and workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(
+            partial(_make_shard, filesystem.path, plan, indexed), shards)
+    else:
+        pool = None
+        results = (
+            _make_shard(filesystem.path, plan, indexed, shard)
+            for shard in shards)
+    try:
+        for entries, oses_used in results:
+            filesystem._record(entries)
+            used.update(oses_used)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    filesystem.save([
+        OperatingSystem(id=oses[os], os_type=os, name=os)
+        for os in oses if os in used])
+
+
+def _plan_network(
+        num_devices, num_users, purpose, heterogeneity, network, seed,
+        software, data):
+    """Works out the parts of a generated network that are the same for
+    every shard (see :func:`generate_network` for the parameters)
+
+    :return: the :class:`_NetworkPlan`, and the random number generator,
+        for the shards' seeds
+    """
 
     # Ratio of device types based on the network purpose. Device types come
     # from the DeviceType enumeration, ratios are educated guesses
@@ -132,168 +250,782 @@ def generate_network(
     else:
         num_blocks = 4 * device_numbers['Networking']
         num_ints = 4
-    ip_range = ipaddress.ip_network(network)
-    subnets = list(ip_range.subnets(new_prefix=24))[:num_blocks]
-    addresses_used = {str(i) : 1 for i in subnets}  # last used ip address
-
-    # Create num_devices devices
-    for d in device_numbers:
-        i = 1  # counting of devices of certain type
-        s = 0  # counting the subnets used
-        while i <= device_numbers[d]:
-            device = Device(
-                name=f'{d} Device {i}',
-                description=f'Randomly generated {d} device',
-                device_types=[d])
-            if d == 'Networking':
-                net_ints = []
-                while len(net_ints) < num_ints:
-                    interface = [f"eth{len(net_ints)}", str(subnets[s][1])]
-                    net_ints.append(interface)
-                    s += 1
-                device.network_interfaces = net_ints
-            else:
-                ipaddr = subnets[s][addresses_used[str(subnets[s])]+1]
-                device.network_interfaces = [["eth0", str(ipaddr)]]
-                addresses_used[str(subnets[s])] += 1
-                s += 1
-                if s >= len(subnets):
-                    s = 0
-            filesystem.save(device)
-            i += 1
-
-    # Create NetworkLink objects
-    for subnet in addresses_used:
-        subnetwork = ipaddress.ip_network(subnet)
-        net_link = NetworkLink(
-            name=subnet, is_logical=True)
-        net_ints = []
-        query = "SELECT id,network_interfaces,device_types FROM Device"
-        _, resp = filesystem.query(query)
-        for device in resp:
-            for interface in device[1]:
-                if ipaddress.ip_address(interface[1]) in subnetwork:
-                    net_ints.append(interface)
-                    filesystem.save(Relationship(device[0], net_link.id))
-        net_link.network_interfaces = net_ints
-        filesystem.save(net_link)
-
-    # Add users; under the current (Mar 2021) draft of Cyber DEM, there isn't
-    # a "user account" object, so using "Persona" object for now
-    i = 1
-    while i <= num_users:
-        persona = Persona(
-            name=f'User {i}', description=f'Randomly generated user persona')
-        filesystem.save(persona)
-        i += 1
-
-    # Add Operating Systems
+    subnets = _AddressPlan(network, num_blocks, device_numbers, num_ints)
+
     # mapping operating systems available by device type (not in Cyber DEM)
     os_to_device = {
         'Controller': [
             'Android',
-            'BSDUnix',
             'Firmware',
-            'GNUUnix',
             'MicrosoftDOS',
             'MicrosoftWindows',
+            'UNIX-Linux',
             ],
         'Generic': [
             'Android',
             'AppleiOS',
             'AppleMacOS',
-            'BSDUnix',
-            'DECHP_UX',
             'DECVMS',
-            'GNUUnix',
-            'LinuxRedHat',
+            'IBMOS 2',
             'MicrosoftWindows',
-            'Ubuntu'
+            'UNIX-Linux',
             ],
         'HMI': [
             'Android',
-            'BSDUnix',
-            'GNUUnix',
-            'LinuxRedHat',
             'MicrosoftWindows',
-            'OpenSolaris',
-            'Ubuntu'
+            'UNIX-Linux',
             ],
         'Monitoring': [
-            'BSDUnix',
-            'GNUUnix',
-            'LinuxRedHat',
             'MicrosoftWindows',
-            'Ubuntu'
+            'UNIX-Linux',
             ],
         'Networking': [
-            'BSDUnix',
             'CiscoIOS',
-            'GNUUnix',
-            'Ubuntu'
+            'Firmware',
+            'UNIX-Linux',
             ],
         'Printer': [
             'Android',
-            'BSDUnix',
             'Firmware',
-            'GNUUnix',
+            'UNIX-Linux',
             ],
         'Scanner': [
             'Android',
-            'BSDUnix',
             'Firmware',
-            'GNUUnix',
+            'UNIX-Linux',
             ],
         'Sensor': [
             'Android',
-            'BSDUnix',
             'Firmware',
-            'GNUUnix',
             'MicrosoftDOS',
+            'UNIX-Linux',
             ],
         'Storage': [
             'Android',
-            'BSDUnix',
-            'DECHP_UX',
-            'GNUUnix',
-            'LinuxRedHat',
             'MicrosoftWindows',
-            'OpenSolaris',
-            'Ubuntu'
+            'UNIX-Linux',
             ]
     }
     # get the variety of OSes available based on the heterogeniety
+    rng = random.Random(seed)
     varieties = {}
     for dt in device_numbers:
         if heterogeneity == 0:
             num_oses = 1
         else:
-            num_oses = int(heterogeneity * (len(os_to_device[dt]) / 5))
+            num_oses = max(
+                1, int(heterogeneity * (len(os_to_device[dt]) / 5)))
         if len(os_to_device[dt]) > num_oses:
-            varieties[dt] = {
-                os : 0 for os in random.sample(os_to_device[dt], num_oses)}
+            varieties[dt] = rng.sample(os_to_device[dt], num_oses)
         else:
-            varieties[dt] = {os : 0 for os in os_to_device[dt]}
-    for device in resp:
-        os = random.choice(list(varieties[device[2][0]].keys()))
-        if varieties[device[2][0]][os] == 0:
-            cd_os = OperatingSystem(os_type=os, name=os)
-            filesystem.save(cd_os)
-            for k in varieties:
-                for i in varieties[k]:
-                    if i == os:
-                        varieties[k][i] = cd_os.id
-        filesystem.save(
-            Relationship(varieties[device[2][0]][os], device[0], 'ResidesOn'))
-
-    # TODO add Software (Applications)
-
-    # TODO add Data
+            varieties[dt] = list(os_to_device[dt])
+    # one OperatingSystem of each type, shared by the devices; only the
+    # ones that are used are saved
+    oses = {
+        os: _random_id(rng) for dt in varieties for os in varieties[dt]}
+
+    # Applications, Services, and Data on each type of device (not in Cyber
+    # DEM): how many in 1000 of the devices have one, its class, and the
+    # kinds there are, ratios are educated guesses
+    inventory_on_device = {
+        'Controller': [
+            (1000, Data, [
+                {'name': 'Control Logic', 'data_type': 'Code'}]),
+            (1000, Data, [
+                {'name': 'Controller Configuration',
+                 'data_type': 'SystemConfiguration'}]),
+            (200, Service, [
+                {'name': 'Controller Web Interface', 'service_type': 'Web'}]),
+            ],
+        'Generic': [
+            (1000, Application, [
+                {'name': 'Firefox', 'company': 'Mozilla'},
+                {'name': 'Chrome', 'company': 'Google'},
+                {'name': 'Edge', 'company': 'Microsoft'},
+                ]),
+            (800, Application, [
+                {'name': 'Microsoft Office', 'company': 'Microsoft'},
+                {'name': 'LibreOffice', 'company': 'The Document Foundation'},
+                ]),
+            (600, Application, [
+                {'name': 'Outlook', 'company': 'Microsoft'},
+                {'name': 'Thunderbird', 'company': 'Mozilla'},
+                ]),
+            (1000, Data, [
+                {'name': 'User Documents', 'data_type': 'File',
+                 'sensitivity': 'FOUO'}]),
+            (300, Data, [
+                {'name': 'Saved Credentials', 'data_type': 'Credentials',
+                 'sensitivity': 'Confidential'}]),
+            (50, Service, [
+                {'name': 'Web Server', 'service_type': 'Web'},
+                {'name': 'Database Server', 'service_type': 'Database'},
+                {'name': 'Chat Server', 'service_type': 'Chat'},
+                ]),
+            ],
+        'HMI': [
+            (1000, Application, [
+                {'name': 'InTouch', 'company': 'AVEVA'},
+                {'name': 'Ignition', 'company': 'Inductive Automation'},
+                {'name': 'WinCC', 'company': 'Siemens'},
+                ]),
+            (1000, Data, [
+                {'name': 'Process Data', 'data_type': 'Communications'}]),
+            ],
+        'Monitoring': [
+            (1000, Application, [
+                {'name': 'Nagios', 'company': 'Nagios Enterprises'},
+                {'name': 'Zabbix', 'company': 'Zabbix'},
+                ]),
+            (1000, Service, [
+                {'name': 'Monitoring Dashboard', 'service_type': 'Web'}]),
+            (1000, Data, [{'name': 'Event Logs', 'data_type': 'File'}]),
+            ],
+        'Networking': [
+            (300, Service, [
+                {'name': 'Time Server', 'service_type': 'NetworkTime'}]),
+            (200, Service, [{'name': 'DNS Server', 'service_type': 'DNS'}]),
+            (1000, Data, [
+                {'name': 'Router Configuration',
+                 'data_type': 'SystemConfiguration'}]),
+            ],
+        'Printer': [
+            (1000, Service, [
+                {'name': 'Printer Web Interface', 'service_type': 'Web'}]),
+            (500, Data, [{'name': 'Print Jobs', 'data_type': 'File'}]),
+            ],
+        'Scanner': [
+            (1000, Data, [{'name': 'Scans', 'data_type': 'File'}]),
+            ],
+        'Sensor': [
+            (1000, Data, [
+                {'name': 'Sensor Readings', 'data_type': 'Communications'}]),
+            ],
+        'Storage': [
+            (1000, Service, [
+                {'name': 'File Server', 'service_type': 'File'}]),
+            (300, Service, [
+                {'name': 'Database Server', 'service_type': 'Database'}]),
+            (1000, Data, [
+                {'name': 'Shared Files', 'data_type': 'File',
+                 'sensitivity': 'FOUO'}]),
+            ],
+        }
+    # the kinds of each available based on the heterogeneity, as template
+    # objects the devices' objects are copied from
+    inventory = {}
+    for dt in device_numbers:
+        inventory[dt] = []
+        for ratio, obj_class, kinds in inventory_on_device[dt]:
+            if not (data if obj_class is Data else software):
+                continue
+            if heterogeneity == 0:
+                num_kinds = 1
+            else:
+                num_kinds = max(1, int(heterogeneity * (len(kinds) / 5)))
+            if len(kinds) > num_kinds:
+                kinds = rng.sample(kinds, num_kinds)
+            inventory[dt].append((
+                ratio, rng.randrange(1000),
+                [obj_class(**kwargs) for kwargs in kinds]))
+
+    plan = _NetworkPlan(
+        subnets, varieties, oses, links_key=rng.getrandbits(64),
+        os_key=rng.getrandbits(64),
+        num_users=num_users, inventory=inventory,
+        inventory_key=rng.getrandbits(64))
+    return plan, rng
+
+
+# most objects of one kind made by a shard of generate_network
+_SHARD_SIZE = 10000
+
+
+def _random_id(rng):
+    """A UUIDv4 string from a random number generator"""
+
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+class _AddressPlan():
+    """The /24 subnets of a network and the addresses of the devices in them
+
+    Interfaces are numbered by device type: device ``i`` of a type has
+    interface ``i``, except Networking devices, whose ``k``th interface is
+    ``i * num_ints + k``. Interface ``g`` of every type is in subnet
+    ``g % len(subnets)``. The first address of each subnet is kept for its
+    first Networking interface; the other interfaces get host addresses in
+    the order the devices are made (the device types in order, then by
+    ``i``). Since each interface's place in that order is known, its address
+    is worked out from its type and number, without listing the subnets or
+    keeping track of the addresses used. With numpy (and an IPv4 network),
+    the addresses of a whole range of interfaces are worked out at once as
+    an integer array.
+
+    :param network: the network address range to use
+    :type network: string, required
+    :param num_blocks: most subnets to use
+    :type num_blocks: int, required
+    :param device_numbers: number of devices of each type, in the order they
+        are made
+    :type device_numbers: dict, required
+    :param num_ints: number of interfaces of each Networking device
+    :type num_ints: int, required
+    """
+
+    def __init__(self, network, num_blocks, device_numbers, num_ints):
+        self.network = ipaddress.ip_network(network)
+        if self.network.prefixlen > 24:
+            raise ValueError(
+                f'network {network} is too small; it must be a /24 or larger')
+        self.size = 2 ** (self.network.max_prefixlen - 24)
+        self.count = min(
+            max(num_blocks, 1), 2 ** (24 - self.network.prefixlen))
+        self.device_numbers = device_numbers
+        self.num_ints = num_ints
+        self._address_type = type(self.network.network_address)
+        self._base = int(self.network.network_address)
+        # IPv6 addresses don't fit in numpy's integers
+        self._vector = numpy is not None and self.network.version == 4
+
+        # subnet 0 has the most host addresses in use
+        hosts = sum(
+            ceil(self.interfaces(d) / self.count) for d in device_numbers)
+        if self.interfaces('Networking'):
+            hosts -= 1  # the gateway
+        if 1 + hosts > self.size - 2:
+            raise ValueError(
+                f'network {self.network} does not have enough addresses for '
+                f'the devices; use a larger network')
+
+    def __len__(self):
+        return self.count
+
+    def name(self, s):
+        """The subnet, in CIDR notation"""
+
+        return f'{self._address_type(self._base + s * self.size)}/24'
+
+    def interfaces(self, d):
+        """Number of interfaces of the devices of type d"""
+
+        per_device = self.num_ints if d == 'Networking' else 1
+        return self.device_numbers.get(d, 0) * per_device
+
+    def addresses(self, d, g):
+        """Addresses of interfaces of type d, as integers, and their subnets
+
+        :param g: interface numbers
+        :type g: numpy array if :attr:`vector`, otherwise list of ints
+        """
+
+        earlier = []  # (interfaces, whether they're Networking)
+        for other in self.device_numbers:
+            if other == d:
+                break
+            earlier.append((self.interfaces(other), other == 'Networking'))
+        networking = d == 'Networking'
+        # the host addresses in subnet s used before interface g: those of
+        # the earlier types, and the ones of this type before it, less the
+        # gateways
+        if self._vector:
+            s = g % self.count
+            host = 2 + g // self.count - networking
+            for total, gateway in earlier:
+                host += total // self.count + (s < total % self.count)
+                if gateway:
+                    host -= s < total
+            if networking:
+                host[g < self.count] = 1
+            return self._base + s * self.size + host, s
+
+        addresses, subnets = [], []
+        for n in g:
+            s = n % self.count
+            if networking and n < self.count:
+                host = 1
+            else:
+                host = 2 + n // self.count - networking
+                for total, gateway in earlier:
+                    host += total // self.count + (s < total % self.count)
+                    if gateway:
+                        host -= s < total
+            addresses.append(self._base + s * self.size + host)
+            subnets.append(s)
+        return addresses, subnets
+
+    @property
+    def vector(self):
+        """Whether interface numbers are numpy arrays"""
+
+        return self._vector
+
+    def numbers(self, start, stop):
+        """Interface numbers start to stop"""
+
+        if self._vector:
+            return numpy.arange(start, stop, dtype=numpy.int64)
+        return list(range(start, stop))
+
+    def subnet_interfaces(self, start, stop):
+        """Interfaces in subnets start to stop
+
+        :return: for each subnet, its interfaces, in the order the devices
+            are made, as (device type, interface number, address) tuples
+        """
+
+        found = [[] for _ in range(start, stop)]
+        for d in self.device_numbers:
+            total = self.interfaces(d)
+            # the interfaces in subnets start to stop: start + j * count,
+            # ..., stop - 1 + j * count, for each j
+            for first in range(start, total, self.count):
+                g = self.numbers(first, min(first + stop - start, total))
+                addresses, _ = self.addresses(d, g)
+                for offset, (n, address) in enumerate(zip(
+                        g.tolist() if self._vector else g,
+                        addresses.tolist() if self._vector else addresses)):
+                    found[offset].append((d, n, address))
+        return found
+
+    def format(self, address):
+        """An integer address as a string"""
+
+        if self.network.version == 4:
+            return socket.inet_ntoa(address.to_bytes(4, 'big'))
+        return str(self._address_type(address))
+
+
+class _NetworkPlan():
+    """Everything needed to make any part of a generated network
+
+    :param subnets: the address plan
+    :type subnets: :class:`_AddressPlan`, required
+    :param varieties: the OSes each type of device can have
+    :type varieties: dict of string -> list of strings, required
+    :param oses: ID of the OperatingSystem of each OS type
+    :type oses: dict, required
+    :param links_key: random number the NetworkLinks' IDs are made from
+    :type links_key: int, required
+    :param os_key: random number the OSes of the devices are chosen with
+    :type os_key: int, required
+    :param num_users: number of users
+    :type num_users: int, required
+    :param inventory: for each type of device, the Applications, Services,
+        and Data the devices can have, as (how many in 1000 devices, offset
+        from 0 to 999, template objects of each kind) tuples
+    :type inventory: dict, required
+    :param inventory_key: random number the kinds of the devices'
+        Applications, Services, and Data are chosen with
+    :type inventory_key: int, required
+    """
+
+    def __init__(
+            self, subnets, varieties, oses, links_key, os_key, num_users,
+            inventory, inventory_key):
+        self.subnets = subnets
+        self.varieties = varieties
+        self.oses = oses
+        self.links_key = links_key
+        self.os_key = os_key
+        self.num_users = num_users
+        self.inventory = inventory
+        self.inventory_key = inventory_key
+        self.num_devices = sum(subnets.device_numbers.values())
+        # the most objects from the inventory one device can have
+        self.slots = max(len(found) for found in inventory.values())
+        # for a virtual network, the IDs are made from this and the kind
+        # and number of each object (see _virtual_id), not at random
+        self.key = None
+
+    def _id(self, kind, number, rng):
+        if self.key is not None:
+            return _virtual_id(self.key, kind, number)
+        return _random_id(rng)
+
+    def link_id(self, s):
+        """ID of the NetworkLink of subnet s"""
+
+        if self.key is not None:
+            return _virtual_id(self.key, _NETWORK_LINK, s)
+        digest = blake2b(f'{self.links_key}:{s}'.encode(), digest_size=16)
+        return str(uuid.UUID(bytes=digest.digest(), version=4))
+
+    def device_types(self, start, stop):
+        """The runs of devices of each type among devices start to stop
+        (counting all types)
+
+        :return: (type, first, last, offset) for each type, where first and
+            last number the devices among those of the type, and device i of
+            the type is device i + offset of all types
+        """
+
+        runs = []
+        offset = 0
+        for d, count in self.subnets.device_numbers.items():
+            first, last = max(start - offset, 0), min(stop - offset, count)
+            if first < last:
+                runs.append((d, first, last, offset))
+            offset += count
+        return runs
+
+    def device_oses(self, d, first, last):
+        """The OS of each of devices first to last of type d"""
+
+        choices = self.varieties[d]
+        numbers = _mix(self.os_key, self.subnets.numbers(first, last), d)
+        if self.subnets.vector:
+            numbers = numbers % numpy.uint64(len(choices))
+            return [choices[c] for c in numbers.tolist()]
+        return [choices[n % len(choices)] for n in numbers]
+
+    def inventory_types(self):
+        """The types of objects in the inventory"""
+
+        return sorted({
+            templates[0]._type for found in self.inventory.values()
+            for _, _, templates in found})
+
+    def inventory_counts(self):
+        """The number of objects of each type in the inventory"""
+
+        counts = dict.fromkeys(self.inventory_types(), 0)
+        for d, count in self.subnets.device_numbers.items():
+            for ratio, offset, templates in self.inventory[d]:
+                counts[templates[0]._type] += (count * ratio + offset) // 1000
+        return counts
+
+    def device_inventory(self, d, first, last):
+        """The Applications, Services, and Data of each of devices first to
+        last of type d
+
+        Device i has one of the objects in a tuple of the inventory if
+        ``(i * ratio + offset) // 1000`` goes up after it, which spreads them
+        evenly over the devices, and makes the number of them among the
+        first c devices ``(c * ratio + offset) // 1000``.
+
+        :return: for each device, a list of (slot, template object) tuples
+        """
+
+        found = [[] for _ in range(first, last)]
+        numbers = self.subnets.numbers(first, last)
+        for t, (ratio, offset, templates) in enumerate(self.inventory[d]):
+            if self.subnets.vector:
+                has = ((numbers + 1) * ratio + offset) // 1000 > \
+                    (numbers * ratio + offset) // 1000
+                having = numbers[has]
+                kinds = _mix(self.inventory_key, having, f'{d}:{t}') % \
+                    numpy.uint64(len(templates))
+                having, kinds = having.tolist(), kinds.tolist()
+            else:
+                having = [
+                    i for i in numbers
+                    if ((i + 1) * ratio + offset) // 1000 >
+                    (i * ratio + offset) // 1000]
+                kinds = [
+                    n % len(templates) for n in
+                    _mix(self.inventory_key, having, f'{d}:{t}')]
+            for i, k in zip(having, kinds):
+                found[i - first].append((t, templates[k]))
+        return found
+
+    def devices(self, start, stop, rng, used):
+        """Devices start to stop, and their Relationships to their
+        NetworkLinks and OperatingSystems, then their Applications, Services,
+        and Data and the Relationships of those to them
+
+        The addresses, OSes, and inventories of each run of devices of the
+        same type are worked out together, before the objects are made.
+
+        :param used: the OSes chosen are added to this set
+        """
+
+        num_ints = self.subnets.num_ints
+        for d, first, last, offset in self.device_types(start, stop):
+            per_device = self.subnets.num_ints if d == 'Networking' else 1
+            addresses, subnets = self.subnets.addresses(
+                d, self.subnets.numbers(first * per_device, last * per_device))
+            if self.subnets.vector:
+                addresses, subnets = addresses.tolist(), subnets.tolist()
+            addresses = [self.subnets.format(a) for a in addresses]
+            oses = self.device_oses(d, first, last)
+            used.update(oses)
+            inventory = self.device_inventory(d, first, last)
+            for i, os_type, found in zip(range(first, last), oses, inventory):
+                n = offset + i
+                device = Device(
+                    id=self._id(_DEVICE, n, rng),
+                    name=f'{d} Device {i + 1}',
+                    description=f'Randomly generated {d} device',
+                    device_types=[d])
+                k = (i - first) * per_device
+                device.network_interfaces = [
+                    [f'eth{j}', addresses[k + j]] for j in range(per_device)]
+                yield device
+                for j, s in enumerate(subnets[k:k + per_device]):
+                    yield Relationship(
+                        device.id, self.link_id(s),
+                        id=self._id(_LINK_RELATIONSHIP, n * num_ints + j, rng))
+                yield Relationship(
+                    self.oses[os_type], device.id, 'ResidesOn',
+                    id=self._id(_OS_RELATIONSHIP, n, rng))
+                for t, template in found:
+                    # copied, so the template's attributes aren't checked
+                    # again for every device
+                    obj = copy(template)
+                    obj.id = self._id(_INVENTORY, n * self.slots + t, rng)
+                    if obj._type == 'Service':
+                        obj.address = addresses[k]
+                    yield obj
+                    yield Relationship(
+                        obj.id, device.id, 'ResidesOn',
+                        id=self._id(
+                            _INVENTORY_RELATIONSHIP, n * self.slots + t, rng))
+
+    def links(self, start, stop):
+        """The NetworkLinks of subnets start to stop"""
+
+        num_ints = self.subnets.num_ints
+        in_subnets = self.subnets.subnet_interfaces(start, stop)
+        for s, found in zip(range(start, stop), in_subnets):
+            net_link = NetworkLink(
+                id=self.link_id(s), name=self.subnets.name(s),
+                is_logical=True)
+            net_link.network_interfaces = [
+                [f'eth{n % num_ints if d == "Networking" else 0}',
+                 self.subnets.format(address)]
+                for d, n, address in found]
+            yield net_link
+
+    def users(self, start, stop, rng):
+        """Users start to stop"""
+
+        # under the current (Mar 2021) draft of Cyber DEM, there isn't a
+        # "user account" object, so using "Persona" object for now
+        for i in range(start, stop):
+            yield Persona(
+                id=self._id(_PERSONA, i, rng), name=f'User {i + 1}',
+                description=f'Randomly generated user persona')
+
+
+class _VirtualNetwork():
+    """A network from :func:`generate_network` that is only made when it is
+    used
+
+    A FileSystem keeps the parameters (from :meth:`dump`) and uses
+    :meth:`get` and :meth:`scan` to make the objects it needs. The first 64
+    bits of each object's ID are the network's :attr:`key`; the others say
+    what kind of object it is and its number (see :func:`_virtual_id`).
+    """
+
+    def __init__(
+            self, num_devices, num_users, purpose, heterogeneity, network,
+            seed, software=True, data=True):
+        self.params = {
+            'num_devices': num_devices, 'num_users': num_users,
+            'purpose': purpose, 'heterogeneity': heterogeneity,
+            'network': network, 'seed': seed, 'software': software,
+            'data': data}
+        digest = blake2b(
+            json.dumps(self.params, sort_keys=True).encode(), digest_size=8)
+        # the UUID version is in the top half
+        self.key = int.from_bytes(digest.digest(), 'big') & ~0xF000 | 0x4000
+
+        self.plan, _ = _plan_network(
+            num_devices, num_users, purpose, heterogeneity, network, seed,
+            software, data)
+        self.plan.key = self.key
+        self.plan.oses = {
+            os: _virtual_id(self.key, _OPERATING_SYSTEM, j)
+            for j, os in enumerate(self.plan.oses)}
+        subnets = self.plan.subnets
+        self.counts = self.plan.inventory_counts()
+        self.counts.update({
+            'Device': num_devices,
+            'NetworkLink': len(subnets),
+            'OperatingSystem': len(self.plan.oses),
+            'Persona': num_users,
+            'Relationship': num_devices + sum(self.counts.values()) + sum(
+                subnets.interfaces(d) for d in subnets.device_numbers)})
+
+    @classmethod
+    def load(cls, params):
+        return cls(**params)
+
+    def dump(self):
+        return self.params
+
+    def _objects(self, kind, start, stop):
+        if kind in (
+                _DEVICE, _LINK_RELATIONSHIP, _OS_RELATIONSHIP, _INVENTORY,
+                _INVENTORY_RELATIONSHIP):
+            return self.plan.devices(start, stop, None, set())
+        if kind == _NETWORK_LINK:
+            return self.plan.links(start, stop)
+        if kind == _PERSONA:
+            return self.plan.users(start, stop, None)
+        return [
+            OperatingSystem(id=id, os_type=os, name=os)
+            for os, id in list(self.plan.oses.items())[start:stop]]
+
+    def scan(self, obj_type):
+        """The json of every object of a type"""
+
+        kind, total = {
+            'Device': (_DEVICE, self.plan.num_devices),
+            'Relationship': (_DEVICE, self.plan.num_devices),
+            'Application': (_INVENTORY, self.plan.num_devices),
+            'Service': (_INVENTORY, self.plan.num_devices),
+            'Data': (_INVENTORY, self.plan.num_devices),
+            'NetworkLink': (_NETWORK_LINK, len(self.plan.subnets)),
+            'Persona': (_PERSONA, self.plan.num_users),
+            'OperatingSystem': (_OPERATING_SYSTEM, len(self.plan.oses)),
+            }.get(obj_type, (None, 0))
+        for start in range(0, total, _SHARD_SIZE):
+            for obj in self._objects(
+                    kind, start, min(start + _SHARD_SIZE, total)):
+                if obj._type == obj_type:
+                    yield obj._serialize()
+
+    def get(self, id):
+        """The json of the object with an ID, or None"""
+
+        number = uuid.UUID(id).int & _MASK64
+        kind, number = (number >> 56) & 0x3F, number & (2 ** 56 - 1)
+        if kind == _LINK_RELATIONSHIP:
+            number //= self.plan.subnets.num_ints
+        elif kind in (_INVENTORY, _INVENTORY_RELATIONSHIP):
+            if not self.plan.slots:
+                return None
+            number //= self.plan.slots
+        total = {
+            _DEVICE: self.plan.num_devices,
+            _LINK_RELATIONSHIP: self.plan.num_devices,
+            _OS_RELATIONSHIP: self.plan.num_devices,
+            _INVENTORY: self.plan.num_devices,
+            _INVENTORY_RELATIONSHIP: self.plan.num_devices,
+            _NETWORK_LINK: len(self.plan.subnets),
+            _PERSONA: self.plan.num_users,
+            _OPERATING_SYSTEM: len(self.plan.oses),
+            }.get(kind, 0)
+        if number >= total:
+            return None
+        for obj in self._objects(kind, number, number + 1):
+            if obj.id == id:
+                return obj._serialize()
+        return None
+
+
+# kinds of objects in a virtual network, for their IDs
+_DEVICE = 1
+_NETWORK_LINK = 2
+_OPERATING_SYSTEM = 3
+_PERSONA = 4
+_LINK_RELATIONSHIP = 5  # numbered device * interfaces per device + interface
+_OS_RELATIONSHIP = 6  # numbered by device
+_INVENTORY = 7  # numbered device * slots + slot (see _NetworkPlan.slots)
+_INVENTORY_RELATIONSHIP = 8  # numbered like _INVENTORY
+
+
+def _virtual_id(key, kind, number):
+    """The ID of object number ``number`` of a kind in a virtual network
+
+    The key is the first 64 bits, the kind the next 6 after the UUID
+    variant, and the number the last 56.
+    """
+
+    return str(uuid.UUID(int=key << 64 | kind << 56 | number, version=4))
+
+
+def _mix(key, numbers, salt=''):
+    """Random 64-bit integers for a range of numbers (SplitMix64 of the
+    numbers added to a key)
+
+    The result for each number only depends on the key and the number, and
+    is the same with or without numpy, so the choices made with it don't
+    depend on how the network is split up, or on whether numpy is installed.
+
+    :param numbers: numpy array of int64s, or list of ints
+    :return: numpy array of uint64s, or list of ints
+    """
+
+    key = (key + int.from_bytes(
+        blake2b(salt.encode(), digest_size=8).digest(), 'big')) & _MASK64
+    if numpy is not None and isinstance(numbers, numpy.ndarray):
+        with numpy.errstate(over='ignore'):
+            z = numpy.uint64(key) + \
+                numbers.astype(numpy.uint64) * numpy.uint64(_GOLDEN)
+            z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(_MIX1)
+            z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(_MIX2)
+            return z ^ (z >> numpy.uint64(31))
+    mixed = []
+    for n in numbers:
+        z = (key + n * _GOLDEN) & _MASK64
+        z = ((z ^ (z >> 30)) * _MIX1) & _MASK64
+        z = ((z ^ (z >> 27)) * _MIX2) & _MASK64
+        mixed.append(z ^ (z >> 31))
+    return mixed
+
+
+# SplitMix64 constants
+_MASK64 = 2 ** 64 - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+_MIX1 = 0xBF58476D1CE4E5B9
+_MIX2 = 0x94D049BB133111EB
+
+
+def _make_shard(path, plan, indexed, shard):
+    """Makes and writes the objects of one shard of generate_network (in a
+    worker process, or this one)
+
+    :param path: the FileSystem's folder
+    :param plan: the :class:`_NetworkPlan`
+    :param indexed: types of objects the FileSystem has indexes of; the
+        json of the others isn't sent back
+    :param shard: (kind, start, stop, seed)
+
+    :return: (obj_type, id, json) entries for the FileSystem's journal, and
+        the OSes used
+    """
+
+    kind, start, stop, seed = shard
+    rng = random.Random(seed)
+    used = set()
+    if kind == 'devices':
+        objects = plan.devices(start, stop, rng, used)
+    elif kind == 'links':
+        objects = plan.links(start, stop)
+    else:
+        objects = plan.users(start, stop, rng)
+
+    entries = []
+    for obj in objects:
+        # the same layout and format as FileSystem.save
+        filepath = os.path.join(path, obj._type, obj.id + '.json')
+        if os.path.isfile(filepath):
+            raise Exception(
+                f'Object {obj.id} already exists in {path}. Use a different '
+                f'seed.')
+        serialized = obj._serialize()
+        with open(filepath, 'w') as outfile:
+            outfile.write(json.dumps(serialized, indent=4))
+        outfile.close()
+        entries.append((
+            obj._type, obj.id,
+            serialized if obj._type in indexed else None))
+    return entries, used
+
 
 def network_summary(
         filesystem, count_only=False, top_N=None, ignore=[], pprint=False):
     """A summary count of CyberObjects in the FileSystem
-    
+
+    The counts come from the FileSystem's id index and histogram indexes
+    (see :meth:`~cyberdem.filesystem.FileSystem.value_counts`), which are
+    kept up to date as objects are saved, so no object files are read
+    (except the first time, to make the histograms). Devices are counted
+    under each of their ``device_types``.
+
     :param filesystem: where the CyberObjects are stored
     :type filesystem: :class:`~cyberdem.filesystem.FileSystem`, required
     :param count_only: if true, provides only a high level count of CyberObjects
@@ -326,15 +1058,15 @@ def network_summary(
         'Systems': 'System'
         }
     type_breakdown = {
-        'Networks': ',mask',
-        'Network Links': '',
-        'Devices': ',device_type',
-        'Services': ',service_type',
-        'Operating systems': ',os_type',
-        'Applications': ',name',
-        'Personas': '',
-        'Data': ',data_type',
-        'Systems': ',system_type'
+        'Networks': 'mask',
+        'Network Links': None,
+        'Devices': 'device_types',
+        'Services': 'service_type',
+        'Operating systems': 'os_type',
+        'Applications': 'name',
+        'Personas': None,
+        'Data': 'data_type',
+        'Systems': 'system_type'
         }
 
     # Check the ignore variable
@@ -347,20 +1079,12 @@ def network_summary(
             del type_breakdown[counts_key]
 
     for obj in counts:
-        query = f"SELECT id{type_breakdown[obj]} FROM {counts[obj]}"
-        _, results = filesystem.query(query)
-        counts[obj] = len(results)
+        attr = type_breakdown[obj]
         type_breakdown[obj] = {}
-        for r in results:
-            try:
-                obj_type = r[1]
-            except IndexError:
-                obj_type = None
-            if obj_type is not None:
-                try:
-                    type_breakdown[obj][obj_type] += 1
-                except KeyError:
-                    type_breakdown[obj][obj_type] = 1
+        if attr and not count_only:
+            for value, n in filesystem.value_counts(counts[obj], attr):
+                type_breakdown[obj][value] = n
+        counts[obj] = filesystem.count(counts[obj])
 
     if count_only:
         data = {'Counts': counts}
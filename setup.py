@@ -27,4 +27,8 @@ setup(
         "Programming Language :: Python :: 3.9",
     ],
     packages=find_packages(),
+    extras_require={
+        # vectorized graph searches and network generation
+        "graph": ["numpy"],
+    },
 )
@@ -0,0 +1,57 @@
+"""
+Tests for cyberdem.filesystem
+"""
+
+from cyberdem.base import Device
+from cyberdem.filesystem import FileSystem
+
+
+def test_query_single_id_with_column_index(tmp_path):
+    fs = FileSystem(str(tmp_path / 'fs'))
+    devices = [Device(name=f'd{i}') for i in range(5)]
+    fs.save(devices)
+    fs.create_index('Device', 'name', kind='column')
+
+    # the id is filtered with the columns, then the files are read
+    headers, rows = fs.query(
+        f"SELECT name,description FROM Device WHERE id='{devices[2].id}'")
+    assert headers == ['name', 'description']
+    assert rows == [('d2', None)]
+
+
+def test_range_index_created_before_objects(tmp_path):
+    fs = FileSystem(str(tmp_path / 'fs'))
+    fs.create_index('Device', 'name', kind='range')
+    fs.save([Device(name=f'd{i:02}') for i in range(30, 0, -1)])
+
+    _, rows = fs.query(
+        "SELECT name FROM Device WHERE name BETWEEN 'd03' AND 'd27'")
+    assert sorted(r[0] for r in rows) == [f'd{i:02}' for i in range(3, 28)]
+    _, rows = fs.query("SELECT name FROM Device WHERE name > 'd25'")
+    assert len(rows) == 5
+    _, rows = fs.query("SELECT name FROM Device ORDER BY name LIMIT 3")
+    assert rows == [('d01',), ('d02',), ('d03',)]
+
+
+def test_get_does_not_return_unsaved_changes(tmp_path):
+    fs = FileSystem(str(tmp_path / 'fs'))
+    device = Device(name='d1', device_types=['Generic'])
+    fs.save(device)
+
+    first = fs.get(device.id)
+    first.name = 'mutated'
+    first.device_types.append('Printer')
+    second = fs.get(device.id)
+    assert second.name == 'd1'
+    assert second.device_types == ['Generic']
+    assert fs.cache_info()['hits'] == 1
+
+
+def test_reindex_clears_get_cache(tmp_path):
+    fs = FileSystem(str(tmp_path / 'fs'))
+    device = Device(name='d1')
+    fs.save(device)
+    fs.get(device.id)
+
+    fs.reindex()
+    assert fs.cache_info()['size'] == 0
@@ -0,0 +1,62 @@
+"""
+Tests for cyberdem.graph
+"""
+
+from cyberdem.base import Device, NetworkLink, OperatingSystem, Relationship
+from cyberdem.filesystem import FileSystem
+from cyberdem.graph import Graph
+
+
+def _two_networks(path):
+    """Two networks of a NetworkLink and two devices (each with an OS), so
+    10 objects in 2 components"""
+
+    fs = FileSystem(path)
+    for _ in range(2):
+        link = NetworkLink(name='link')
+        objects = [link]
+        for _ in range(2):
+            device = Device(name='device')
+            os = OperatingSystem(name='os')
+            objects += [
+                device, os, Relationship(device.id, link.id),
+                Relationship(os.id, device.id, 'ResidesOn')]
+        fs.save(objects)
+    return fs
+
+
+def test_graph_has_only_object_vertices(tmp_path):
+    fs = _two_networks(str(tmp_path / 'fs'))
+    objects = sum(
+        fs.count(t) for t in ('Device', 'NetworkLink', 'OperatingSystem'))
+    graph = Graph(fs)
+
+    # len() is the number of edges; Relationships aren't vertices
+    assert len(graph.ids) == objects == 10
+    assert len(graph) == 2 * fs.count('Relationship')
+    assert not set(graph.ids) & set(
+        r[0] for r in fs.query('SELECT id FROM Relationship')[1])
+
+
+def test_components_and_reach_counts(tmp_path):
+    fs = _two_networks(str(tmp_path / 'fs'))
+    graph = Graph(fs)
+
+    labels = graph.components()
+    sizes = {}
+    for label in labels:
+        sizes[label] = sizes.get(label, 0) + 1
+    assert sorted(sizes.values()) == [5, 5]
+    assert [c['size'] for c in fs.components()] == [5, 5]
+
+    counts = graph.reach_counts()
+    assert set(counts) == set(graph.ids)
+    assert set(counts.values()) == {4}
+
+    # following Relationships one way, OSes reach their device and its
+    # NetworkLink, and NetworkLinks are sinks
+    out = Graph(fs, direction='out').reach_counts()
+    _, oses = fs.query('SELECT id FROM OperatingSystem')
+    _, links = fs.query('SELECT id FROM NetworkLink')
+    assert {out[os] for os, in oses} == {2}
+    assert {out[link] for link, in links} == {0}